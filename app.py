@@ -1,301 +1,175 @@
 import streamlit as st
-import geopandas as gpd
 import folium
 from folium.plugins import Draw, FloatImage
-from shapely.geometry import shape
-from shapely.ops import unary_union
-from streamlit_folium import st_folium
+from streamlit_folium import generate_leaflet_string, st_folium
 import pandas as pd
 from io import BytesIO
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image as XLImage
-import requests
-from datetime import datetime, timedelta, timezone
 import os
 import base64
-from PIL import Image
-import io
 import asyncio
+import hashlib
+import json
 import sys
+import threading
+from communes import (
+    NO_COMMUNE, SelectionMemo, count_points_by_district, group_by_district,
+    polygons_from_geojson, polygons_from_wkb, polygons_to_wkb, read_points_csv,
+)
+from radar import RADAR_HISTORY_FRAMES, RadarFetcher
+from radar_animation import radar_animation_layer
+from metrics import METRICS, timed
+from jobs import FAILED, JobExecutor
+from blobs import BlobStore
+import warmup
+# Excel (openpyxl), xử lý ảnh (PIL: radar_image, report) và vector tiles chỉ được import
+# trong hàm dùng tới chúng; chạy qua `python warmup.py` để nạp sẵn trước khi nhận request
+from capture import CROP_MAX_LAT, CROP_MAX_LON, CROP_MIN_LAT, CROP_MIN_LON, RadarCaptureService
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+
 # =====================
-# ⚙️ CẤU HÌNH CROP RADAR
+# 🌧️ TẢI ẢNH RADAR (song song, cache chung giữa các session)
 # =====================
-RADAR_URL = "https://iweather.gov.vn/dashboard/?productRadar=CMAX&areaRadar=VIN"
+@st.cache_resource
+def get_radar_fetcher():
+    """Fetcher dùng chung 1 connection pool + cache khung radar theo ymdhm
 
-# Vùng cần crop (tọa độ địa lý)
-CROP_MIN_LAT = 18.3
-CROP_MAX_LAT = 20.5
-CROP_MIN_LON = 103.5
-CROP_MAX_LON = 106.1
+    1 luồng nền/process tải khung mới ngay khi phát hành, giải mã sẵn lưới dBZ và
+    khung đã crop cho lớp phủ; các session chỉ đọc từ cache chung.
+    """
+    from radar_image import decode_dbz_levels
 
-# ⚠️ Vị trí chèn ảnh vào Excel — thay đổi khi bạn xác định ô cụ thể
-RADAR_IMG_CELL = "B14"  # Ảnh sẽ được neo tại B14, kéo dài đến G23
+    fetcher = RadarFetcher()
+    fetcher.start_prefetch(variants={"dbz_levels": decode_dbz_levels, "overlay": build_radar_overlay})
+    return fetcher
 
-# =====================
-# 🛰️ HÀM LẤY URL ẢNH RADAR
-# =====================
-def get_vin_radar_urls():
-    """Lấy 2 URL ảnh radar mới nhất từ trạm VIN"""
-    base_url = "http://hymetnet.gov.vn/dataout_web/VIN"
-    
-    t1 = datetime.now(timezone.utc) - timedelta(minutes=10)
-    t1 = t1.replace(minute=(t1.minute // 10) * 10, second=0, microsecond=0)
-    
-    t0 = t1 - timedelta(minutes=10)
-    t0 = t0.replace(minute=(t0.minute // 10) * 10, second=0, microsecond=0)
-    
-    def fmt(dt):
-        ymd = dt.strftime("%Y%m%d")
-        ymdhm = dt.strftime("%Y%m%d%H%M")
-        dt_utc7 = dt + timedelta(hours=7)
-        display_time = dt_utc7.strftime("%H:%M")
-        return ymd, ymdhm, display_time, dt
-    
-    ymd0, ymdhm0, display0, dt0 = fmt(t0)
-    ymd1, ymdhm1, display1, dt1 = fmt(t1)
-    
-    url0 = f"{base_url}/{ymd0}/VIN_{ymdhm0}_CMAX00.png"
-    url1 = f"{base_url}/{ymd1}/VIN_{ymdhm1}_CMAX00.png"
-    
-    return [(ymdhm0, url0, display0, dt0), (ymdhm1, url1, display1, dt1)]
+def build_radar_overlay(png_bytes):
+    """Khung radar cho lớp phủ: crop theo bbox lớp xã + lượng tử về bảng màu legend"""
+    from radar_image import transcode_frame
 
-# =====================
-# 🌧️ TẢI VÀ CHUYỂN ẢNH RADAR SANG BASE64
-# =====================
-def download_radar_as_base64(url):
-    try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            img_base64 = base64.b64encode(r.content).decode()
-            return f"data:image/png;base64,{img_base64}"
-        return None
-    except:
-        return None
-
-def load_all_radars():
-    urls = get_vin_radar_urls()
-    loaded_radars = []
-    for timecode, url, display_time, dt in urls:
-        try:
-            radar_base64 = download_radar_as_base64(url)
-            if radar_base64:
-                loaded_radars.append((timecode, radar_base64, display_time, dt))
-        except:
-            pass
-    return loaded_radars
+    return transcode_frame(png_bytes, tuple(gdf.total_bounds))
+
+def radar_overlay(timecode):
+    """Khung gọn cho lớp phủ bản đồ — tính 1 lần, cache cạnh khung gốc (None nếu chưa tải)"""
+    return get_radar_fetcher().frame_variant(timecode, "overlay", build_radar_overlay)
+
+def load_all_radars(n=RADAR_HISTORY_FRAMES):
+    return get_radar_fetcher().load_frames(n)
 
 # =====================
 # 🎨 TẢI LEGEND RADAR
 # =====================
-@st.cache_data
 def load_legend_base64():
-    try:
-        with open("legend_radar.jpg", "rb") as f:
-            legend_data = f.read()
-        legend_base64 = base64.b64encode(legend_data).decode()
-        return f"data:image/jpg;base64,{legend_base64}"
-    except FileNotFoundError:
+    legend_base64 = warmup.legend_data_uri()
+    if legend_base64 is None:
         st.warning("⚠️ Không tìm thấy file 'legend_radar.jpg' trong cùng thư mục.")
-        return None
+    return legend_base64
 
 # =====================
-# ⚙️ Tải shapefile Nghệ An
+# ⚙️ Tải shapefile Nghệ An (lớp xã + chỉ mục cache theo process, xem warmup.py)
 # =====================
-@st.cache_data
-def load_shapefile():
-    gdf = gpd.read_file("Xa_NA_chuan.geojson")
-    return gdf.to_crs(epsg=4326)
+@st.cache_resource
+def load_vector_tiles(_gdf):
+    """Tạo sẵn vector tiles cho lớp xã vào static/tiles (1 lần / process)"""
+    from vector_tiles import generate_vector_tiles
 
-gdf = load_shapefile()
+    return generate_vector_tiles(_gdf)
 
-# =====================
-# 📝 HÀM GHI VÀO MERGED CELL
-# =====================
-def write_to_merged_cell(ws, row, col, value):
-    """Ghi giá trị vào ô có thể là merged cell: unmerge → ghi → re-merge"""
-    for merged_range in list(ws.merged_cells.ranges):
-        if (merged_range.min_row <= row <= merged_range.max_row and
-                merged_range.min_col <= col <= merged_range.max_col):
-            merge_str = str(merged_range)
-            ws.unmerge_cells(merge_str)
-            ws.cell(row=merged_range.min_row,
-                    column=merged_range.min_col, value=value)
-            ws.merge_cells(merge_str)
-            return
-    ws.cell(row=row, column=col, value=value)
+gdf = warmup.commune_layer()
+commune_index = warmup.commune_index()
 
 # =====================
-# 🧹 HÀM XÓA DỮ LIỆU TỪ DÒNG 46 ĐẾN DÒNG CUỐI CÓ DỮ LIỆU
+# 📄 Template Excel (đọc 1 lần / process)
 # =====================
-def clear_rows_from_46(ws):
-    last_row = 46
-    for row in ws.iter_rows():
-        for cell in row:
-            if cell.row >= 46 and cell.value is not None:
-                if cell.row > last_row:
-                    last_row = cell.row
-    for row_idx in range(46, last_row + 1):
-        for col_idx in range(1, ws.max_column + 1):
-            try:
-                ws.cell(row=row_idx, column=col_idx).value = None
-            except AttributeError:
-                pass
+def load_report_template():
+    """Phân tích template.xlsx 1 lần, mỗi lần xuất chỉ sao chép bản đã cache"""
+    return warmup.report_template()
 
 # =====================
-# 🙈 HÀM ẨN DÒNG TỪ 60 ĐẾN DÒNG CUỐI CÓ DỮ LIỆU
+# 📸 CHỤP VÀ CROP ẢNH RADAR TỪ WEBSITE
 # =====================
-def hide_rows_60_to_last(ws):
-    last_row = 59
-    for row in ws.iter_rows():
-        for cell in row:
-            if cell.row >= 60 and cell.value is not None:
-                if cell.row > last_row:
-                    last_row = cell.row
-    if last_row >= 60:
-        for row_idx in range(60, last_row + 1):
-            ws.row_dimensions[row_idx].hidden = True
+@st.cache_resource
+def get_capture_service():
+    """Trình duyệt Playwright chạy nền, khởi động 1 lần / process"""
+    return RadarCaptureService()
 
-# =====================
-# 📸 HÀM CHỤP VÀ CROP ẢNH RADAR TỪ WEBSITE
-# =====================
-async def _capture_radar_async():
-    """Dùng Playwright chụp trang radar, tự động cài đặt trình duyệt nếu thiếu"""
-    try:
-        from playwright.async_api import async_playwright
-    except ImportError:
-        return None, "❌ Chưa cài Playwright trong requirements.txt"
+def capture_radar_crop(job, service, store):
+    """Việc nền: chụp ảnh radar bằng trang đã mở sẵn → (id ảnh trong kho chung, lỗi)"""
+    job.update(message="Đang chụp và crop ảnh radar...")
+    img_buf, err = service.capture()
+    return (store.put(img_buf) if img_buf is not None else None), err
 
-    try:
-        # Tự động cài đặt chromium nếu chưa có (dành cho Streamlit Cloud)
-        import subprocess
-        subprocess.run(["playwright", "install", "chromium"], check=False)
-
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",          # Bắt buộc trên Linux Container
-                    "--disable-gpu",         # Giúp ổn định hơn trên server
-                    "--disable-dev-shm-usage" # Tránh lỗi bộ nhớ đệm trên Docker
-                ]
-            )
+@st.cache_resource
+def get_radar_composer(_gdf):
+    """Ghép ảnh radar + nền xã bằng xử lý ảnh thuần (cache nền theo kích thước)"""
+    from radar_image import RadarComposer
 
-            context = await browser.new_context(
-                viewport={"width": 1920, "height": 1080},
-                device_scale_factor=3,   # ↑ tăng lên 3x → ảnh sắc nét hơn nhiều
-                user_agent="Mozilla/5.0"
-            )
+    return RadarComposer(_gdf)
 
-            page = await context.new_page()
+@st.cache_resource
+def get_commune_radar_stats(_gdf):
+    """Lưới nhãn xã trên lưới ảnh radar (raster hóa 1 lần / process)"""
+    from radar_image import CommuneRadarStats
 
-            # ✅ giữ URL cũ của bạn (không đổi)
-            await page.goto(RADAR_URL, wait_until="domcontentloaded", timeout=60000)
+    return CommuneRadarStats(_gdf)
 
-            # ✅ chờ map load đúng cách (tránh timeout)
-            await page.wait_for_selector("canvas", timeout=20000)
-            await page.wait_for_timeout(4000)
+@st.cache_data(ttl=3600, max_entries=64)
+def commune_radar_stats(timecode, threshold):
+    """Các xã có max dBZ ≥ ngưỡng trong khung radar timecode → (xã, bảng thống kê)"""
+    from radar_image import decode_dbz_levels
 
-            # ✅ Chờ Leaflet map sẵn sàng
-            for _ in range(20):
-                map_el = await page.query_selector(".leaflet-container")
-                if map_el:
-                    break
-                await page.wait_for_timeout(1000)
-            else:
-                return None, "❌ Không tìm thấy bản đồ sau 20 giây"
-
-            # ✅ Zoom IN Leaflet vào tâm vùng cần chụp (không dùng fitBounds để tránh zoom out)
-            center_lat = (CROP_MIN_LAT + CROP_MAX_LAT) / 2
-            center_lon = (CROP_MIN_LON + CROP_MAX_LON) / 2
-            zoom_js = f"""() => {{
-                try {{
-                    let map = null;
-                    // Cách 1: biến toàn cục phổ biến
-                    if (window._map && window._map.setView) map = window._map;
-                    else if (window.map && window.map.setView) map = window.map;
-                    // Cách 2: duyệt window
-                    if (!map) {{
-                        for (const key of Object.keys(window)) {{
-                            const obj = window[key];
-                            if (obj && typeof obj === 'object' && obj.fitBounds && obj.setView) {{
-                                map = obj; break;
-                            }}
-                        }}
-                    }}
-                    // Cách 3: lấy từ DOM element nội bộ Leaflet
-                    if (!map) {{
-                        const el = document.querySelector('.leaflet-container');
-                        if (el && el._leaflet_map) map = el._leaflet_map;
-                    }}
-                    if (!map) return map.getZoom();
-                    const currentZoom = map.getZoom();
-                    const targetZoom = 8;  // zoom level cho vùng Nghệ An (~2° × 2.6°)
-                    // Chỉ zoom IN — không bao giờ zoom out
-                    const newZoom = Math.max(currentZoom, targetZoom);
-                    map.setView([{center_lat}, {center_lon}], newZoom, {{ animate: false }});
-                    return newZoom;
-                }} catch(e) {{ return -1; }}
-            }}"""
-
-            zoom_result = await page.evaluate(zoom_js)
-            if zoom_result and zoom_result > 0:
-                await page.wait_for_timeout(2000)  # chờ tiles reload sau setView
-            else:
-                await page.wait_for_timeout(500)
-
-            # =====================
-            # 🖱️ Focus vào map + scroll zoom IN thêm (theo gợi ý ChatGPT, cải tiến)
-            # =====================
-            box = await map_el.bounding_box()
-            cx = box["x"] + box["width"]  / 2 + 30
-            cy = box["y"] + box["height"] / 2 - 100
-
-            # Click vào giữa map để đảm bảo nhận sự kiện wheel
-            await page.mouse.click(cx, cy)
-
-            # Scroll zoom IN 2 lần (scroll up = zoom in trong Leaflet)
-            SCROLL_TIMES = 2        # tăng nếu muốn zoom sâu hơn
-            SCROLL_DELTA = -300     # âm = lên = zoom in; giảm xuống -600 nếu mỗi bước zoom ít
-            for _ in range(SCROLL_TIMES):
-                await page.mouse.wheel(0, SCROLL_DELTA)
-                await page.wait_for_timeout(1500)   # chờ tile load sau mỗi bước
-
-            # =====================
-            # 📸 Chụp full page rồi crop theo bounding box của map element
-            # =====================
-            full_img_bytes = await page.screenshot(
-                full_page=False,    # chụp viewport (không scroll thêm)
-                type="png",
-                scale="device"      # device pixel ratio → sắc nét
-            )
-            await browser.close()
+    levels = get_radar_fetcher().frame_variant(timecode, "dbz_levels", decode_dbz_levels)
+    if levels is None:
+        raise ValueError(f"chưa tải được khung radar {timecode}")
+    return get_commune_radar_stats(gdf).select_over(None, threshold, levels)
 
-            # Crop chính xác vùng map element từ ảnh full viewport
-            img  = Image.open(io.BytesIO(full_img_bytes))
-            dpr  = 3  # phải khớp với device_scale_factor ở trên
-            x1   = int(box["x"]      * dpr)
-            y1   = int(box["y"]      * dpr)
-            x2   = int((box["x"] + box["width"])  * dpr)
-            y2   = int((box["y"] + box["height"]) * dpr)
-            cropped = img.crop((x1, y1, x2, y2))
+# Khởi động trình duyệt nền ngay từ đầu (không chặn giao diện)
+get_capture_service()
 
-            buf = io.BytesIO()
-            cropped.save(buf, format='PNG')
-            buf.seek(0)
+# =====================
+# 🗄️ KHO ẢNH CHUNG — session chỉ giữ id nội dung, không giữ bytes ảnh
+# =====================
+@st.cache_resource
+def get_blob_store():
+    """Ảnh radar đã chụp/ghép của mọi session, lưu 1 lần theo hash, có giới hạn dung lượng"""
+    return BlobStore()
 
-            return buf, None
+def session_screenshot():
+    """BytesIO ảnh radar của session (None nếu chưa có hoặc đã bị bỏ khỏi kho chung)"""
+    data = get_blob_store().get(st.session_state.get("radar_screenshot_id"))
+    return BytesIO(data) if data is not None else None
 
-    except Exception as e:
-        import traceback
-        return None, f"❌ Lỗi Playwright: {type(e).__name__}: {str(e)}\n\n{traceback.format_exc()}"
+# =====================
+# 🧵 VIỆC CHẠY NỀN (chụp radar, xuất Excel) — không chặn rerun của session
+# =====================
+JOB_POLL_SECONDS = 1
+
+@st.cache_resource
+def get_job_executor():
+    """Hàng đợi việc chậm dùng chung mọi session, gộp các việc trùng đang chạy"""
+    return JobExecutor()
+
+def poll_job(job_id, render):
+    """Hiển thị trạng thái việc nền bằng render(job); tự hỏi lại khi việc còn chạy
+
+    Chỉ fragment này chạy lại mỗi JOB_POLL_SECONDS giây (bản đồ không bị vẽ lại);
+    việc vừa xong → chạy lại cả trang để hiện kết quả và dừng hỏi.
+    """
+    job = get_job_executor().get(job_id)
+    polling = job is not None and job.active
+
+    @st.fragment(run_every=JOB_POLL_SECONDS if polling else None)
+    def job_status():
+        current = get_job_executor().get(job_id)
+        if polling and not (current and current.active):
+            st.rerun()
+        render(current)
 
+    job_status()
 
-def capture_radar_crop():
-    """Wrapper đồng bộ cho hàm async"""
-    return asyncio.run(_capture_radar_async())
+def show_job_progress(job):
+    if job is not None and job.active:
+        st.progress(job.progress, text=f"⏳ {job.label}: {job.message} ({job.elapsed:.0f}s)")
 
 
 # =====================
@@ -308,19 +182,49 @@ st.title("🗺️ Bản đồ Nghệ An với Radar và chọn vùng")
 # 📡 Sidebar - Cài đặt Radar
 # =====================
 with st.sidebar:
+    st.header("🗺️ Lớp xã")
+    use_vector_tiles = st.checkbox(
+        "Dùng vector tiles (chỉ tải vùng đang xem)",
+        value=False,
+        help="Cần bật server.enableStaticServing trong .streamlit/config.toml",
+    )
+    if use_vector_tiles:
+        with st.spinner("Đang tạo vector tiles lớp xã..."):
+            tile_count, tile_err = load_vector_tiles(gdf)
+        if tile_err:
+            st.error(tile_err)
+            use_vector_tiles = False
+
+    st.divider()
+
     st.header("📡 Cài đặt lớp Radar")
     show_radar = st.checkbox("Hiển thị ảnh Radar", value=True)
     
+    animate_radar = False
     if show_radar:
         radar_opacity = st.slider("Độ trong suốt Radar", 0.0, 1.0, 0.6, 0.1)
+        radar_frames = st.slider(
+            "Số khung radar (mỗi khung 10 phút)", 1, 18, RADAR_HISTORY_FRAMES
+        )
         
         with st.spinner("Đang tải ảnh radar..."):
-            loaded_radars = load_all_radars()
+            loaded_radars = load_all_radars(radar_frames)
         
         if loaded_radars:
             st.success(f"✅ Đã tải {len(loaded_radars)} ảnh radar")
-            
-            if len(loaded_radars) > 1:
+
+            # 🎞️ Hoạt ảnh: chuyển khung ngay trên bản đồ, không rerun khi xem lại vòng lặp
+            animate_radar = len(loaded_radars) > 1 and st.checkbox(
+                "🎞️ Chạy vòng lặp radar trên bản đồ",
+                value=False,
+                help="Tải 1 lần toàn bộ khung đã chọn, chạy/lùi/tiến bằng nút trên bản đồ",
+            )
+
+            if animate_radar:
+                # Các chức năng khác (ngưỡng, tạo ảnh) dùng khung mới nhất
+                timecode, display_time = loaded_radars[-1]
+                st.info(f"🕐 {loaded_radars[0][1]} → {display_time} (UTC+7)")
+            elif len(loaded_radars) > 1:
                 radar_idx = st.slider(
                     "Chọn thời điểm radar:",
                     0,
@@ -328,15 +232,21 @@ with st.sidebar:
                     len(loaded_radars) - 1,
                     format=""
                 )
-                timecode, radar_base64, display_time, dt = loaded_radars[radar_idx]
+                timecode, display_time = loaded_radars[radar_idx]
                 st.info(f"🕐 {display_time} (UTC+7)")
             else:
-                timecode, radar_base64, display_time, dt = loaded_radars[0]
+                timecode, display_time = loaded_radars[0]
                 st.info(f"🕐 {display_time} (UTC+7)")
         else:
             st.warning("⚠️ Không tìm thấy ảnh radar khả dụng")
             show_radar = False
 
+    # 🎯 Chọn sẵn xã theo cường độ radar của khung đang chọn
+    select_by_radar = False
+    if show_radar:
+        dbz_threshold = st.slider("Ngưỡng chọn xã theo radar (dBZ)", 10, 65, 35, 5)
+        select_by_radar = st.button("🎯 Lấy xã theo ngưỡng radar", use_container_width=True)
+
     st.divider()
 
     # =====================
@@ -346,92 +256,197 @@ with st.sidebar:
     st.caption(f"Vùng crop: {CROP_MIN_LAT}–{CROP_MAX_LAT}°N, {CROP_MIN_LON}–{CROP_MAX_LON}°E")
 
     if st.button("📸 Chụp màn hình Radar", use_container_width=True):
-        with st.spinner("Đang chụp và crop ảnh radar..."):
-            img_buf, err = capture_radar_crop()
-        if err:
-            st.error(err)
+        # Chụp ở luồng nền; bấm đúp / nhiều session cùng bấm → dùng chung 1 lượt chụp
+        st.session_state.capture_job = get_job_executor().submit(
+            "capture", "Chụp ảnh radar", capture_radar_crop, get_capture_service(), get_blob_store()
+        ).id
+
+    if st.session_state.get("capture_job"):
+        capture_job = get_job_executor().get(st.session_state.capture_job)
+        if capture_job is None:
+            # Việc đã bị bỏ khỏi hàng đợi (quá hạn giữ / server khởi động lại)
+            del st.session_state.capture_job
+            st.warning("⚠️ Lượt chụp ảnh radar đã hết hạn — nhấn chụp lại.")
+        elif capture_job.active:
+            poll_job(st.session_state.capture_job, show_job_progress)
+        else:
+            # Việc đã xong → đưa ảnh vào session đúng 1 lần
+            del st.session_state.capture_job
+            if capture_job.status == FAILED:
+                st.error(f"❌ Lỗi chụp ảnh radar: {capture_job.error.splitlines()[0]}")
+            elif capture_job.result[1]:
+                st.error(capture_job.result[1])
+            else:
+                st.session_state.radar_screenshot_id = capture_job.result[0]
+                st.success(f"✅ Đã chụp xong! ({capture_job.elapsed:.0f}s)")
+
+    # Cách nhanh: crop trực tiếp ảnh CMAX đang hiển thị + ghép nền xã (không cần trình duyệt)
+    if st.button("🖼️ Tạo ảnh từ dữ liệu radar (nhanh)", use_container_width=True):
+        png_bytes = get_radar_fetcher().frame_bytes(timecode) if show_radar else None
+        if png_bytes:
+            st.session_state.radar_screenshot_id = get_blob_store().put(get_radar_composer(gdf).compose(
+                png_bytes, (CROP_MIN_LON, CROP_MIN_LAT, CROP_MAX_LON, CROP_MAX_LAT)
+            ))
+            st.success(f"✅ Đã tạo ảnh radar lúc {display_time}!")
         else:
-            st.session_state.radar_screenshot = img_buf
-            st.success("✅ Đã chụp xong!")
+            st.warning("⚠️ Chưa có ảnh radar — bật lớp Radar ở trên trước.")
 
-    if "radar_screenshot" in st.session_state and st.session_state.radar_screenshot:
-        st.image(st.session_state.radar_screenshot, caption="Preview ảnh radar đã crop", use_container_width=True)
+    radar_screenshot = session_screenshot()
+    if radar_screenshot is not None:
+        st.image(radar_screenshot, caption="Preview ảnh radar đã crop", use_container_width=True)
         if st.button("🗑️ Xóa ảnh", use_container_width=True):
-            st.session_state.radar_screenshot = None
+            st.session_state.radar_screenshot_id = None
             st.rerun()
+    elif st.session_state.get("radar_screenshot_id"):
+        st.session_state.radar_screenshot_id = None
+        st.warning("⚠️ Ảnh radar cũ đã bị xóa khỏi bộ nhớ đệm — hãy chụp/tạo lại.")
+
+    st.divider()
+    show_metrics = st.checkbox(
+        "⏱️ Bảng đo hiệu năng (debug)",
+        value=False,
+        help="Thời gian từng bước (p50/p90/p99, gộp mọi session) — JSON tại /app/static/metrics.json",
+    )
 
 # =====================
-# 🗺️ Bản đồ nền
+# 🗺️ Bản đồ nền (phần tĩnh — dựng 1 lần / process)
 # =====================
 center = [19.23, 104.8]
-m = folium.Map(location=center, zoom_start=9, tiles="OpenStreetMap")
+zoom_start = warmup.MAP_ZOOM_START
+commune_style = {"color": "gray", "weight": 1, "fillOpacity": 0.1}
 
-folium.GeoJson(
-    gdf,
-    name="📍 Các xã Nghệ An",
-    style_function=lambda x: {"color": "gray", "weight": 1, "fillOpacity": 0.1},
-    tooltip=folium.GeoJsonTooltip(fields=["Xa", "Diem"], aliases=["Xã:", "Huyện:"]),
-).add_to(m)
+@st.cache_resource
+def load_base_map(use_vector_tiles, show_legend):
+    """Nền OSM + lớp xã + legend + công cụ vẽ — dựng 1 lần cho mỗi tổ hợp tùy chọn
 
-# =====================
-# 🛰️ Thêm lớp Radar vào bản đồ
-# =====================
-if show_radar and loaded_radars:
-    center_lat, center_lon = 18.656, 105.71083
-    radius_deg = 2.8
+    Bản đồ được dùng chung giữa các lần rerun/session: HTML của phần tĩnh không đổi
+    nên st_folium không dựng lại map (giữ nguyên vị trí zoom và các vùng đã vẽ),
+    chỉ lớp radar (feature group động) được cập nhật.
+    """
+    with timed("map.build"):
+        m = folium.Map(location=center, zoom_start=zoom_start, tiles="OpenStreetMap")
 
-    bounds = [
-        [center_lat - radius_deg, center_lon - radius_deg],
-        [center_lat + radius_deg, center_lon + radius_deg]
-    ]
+        if use_vector_tiles:
+            # Lớp xã dạng vector tiles: trình duyệt chỉ tải các tile đang hiển thị
+            from vector_tiles import add_vector_tile_layer
 
+            add_vector_tile_layer(m, "📍 Các xã Nghệ An", commune_style)
+        else:
+            # Lớp hiển thị dùng hình học đã rút gọn theo mức zoom (nhẹ hơn nhiều so với gdf gốc)
+            folium.GeoJson(
+                warmup.display_layer(zoom_start),
+                name="📍 Các xã Nghệ An",
+                style_function=lambda x: commune_style,
+                tooltip=folium.GeoJsonTooltip(fields=["Xa", "Diem"], aliases=["Xã:", "Huyện:"]),
+            ).add_to(m)
+
+        legend_base64 = load_legend_base64() if show_legend else None
+        if legend_base64:
+            legend_html = f'''
+            <div style="
+                position: fixed;
+                bottom: 25px;
+                left: 10px;
+                width: 42px;
+                height: auto;
+                z-index: 9999;
+                background-color: rgba(255, 255, 255, 0.9);
+                border: 2px solid grey;
+                border-radius: 5px;
+                padding: 5px;
+            ">
+                <img src="{legend_base64}" style="width: 100%; height: auto;">
+            </div>
+            '''
+            m.get_root().html.add_child(folium.Element(legend_html))
+
+        # ✏️ Công cụ vẽ
+        Draw(
+            export=False,
+            draw_options={
+                "polygon": {"allowIntersection": False, "showArea": True, "repeatMode": True},
+                "rectangle": False,
+                "circle": False,
+                "circlemarker": False,
+                "polyline": False,
+                "marker": False,
+            },
+            edit_options={"edit": True, "remove": True},
+        ).add_to(m)
+
+    # Chạy trước 1 lượt như st_folium: lượt đầu folium còn đổi id/thêm lệnh addTo,
+    # từ lượt sau script của phần tĩnh giống hệt nhau → frontend không dựng lại map
+    with timed("map.serialize"):
+        m.get_root().render()
+        m.render()
+        generate_leaflet_string(m)
+    # st_folium gắn tạm lớp động vào map → khóa để các session không đè lên nhau
+    return m, threading.Lock()
+
+# =====================
+# 🛰️ Lớp Radar (phần động — chỉ phần này thay đổi khi kéo slider)
+# =====================
+@st.cache_resource(max_entries=64)
+def load_radar_layer(timecode, display_time, opacity):
+    """Feature group chứa ảnh radar của 1 khung + độ trong suốt (cache → HTML giống hệt)
+
+    Nhúng khung đã crop theo lớp xã + lượng tử bảng màu thay cho ảnh CMAX gốc
+    (cả đĩa radar) → dữ liệu đẩy qua st_folium nhỏ hơn nhiều lần.
+    """
+    overlay = radar_overlay(timecode)
+    if overlay is None:
+        # Lỗi không bị st.cache_resource giữ lại → lượt sau thử tải lại
+        raise ValueError(f"chưa tải được khung radar {display_time}")
+    png_bytes, bounds = overlay
+    fg = folium.FeatureGroup(name=f"🌧️ Radar {display_time}")
     folium.raster_layers.ImageOverlay(
-        image=radar_base64,
+        image=f"data:image/png;base64,{base64.b64encode(png_bytes).decode()}",
         bounds=bounds,
-        opacity=radar_opacity,
+        opacity=opacity,
         name=f"🌧️ Radar {display_time}",
         interactive=False,
         cross_origin=False,
         zindex=1
-    ).add_to(m)
-
-    legend_base64 = load_legend_base64()
-    if legend_base64:
-        legend_html = f'''
-        <div style="
-            position: fixed;
-            bottom: 25px;
-            left: 10px;
-            width: 42px;
-            height: auto;
-            z-index: 9999;
-            background-color: rgba(255, 255, 255, 0.9);
-            border: 2px solid grey;
-            border-radius: 5px;
-            padding: 5px;
-        ">
-            <img src="{legend_base64}" style="width: 100%; height: auto;">
-        </div>
-        '''
-        m.get_root().html.add_child(folium.Element(legend_html))
-
-# =====================
-# ✏️ Công cụ vẽ
-# =====================
-Draw(
-    export=False,
-    draw_options={
-        "polygon": {"allowIntersection": False, "showArea": True, "repeatMode": True},
-        "rectangle": False,
-        "circle": False,
-        "circlemarker": False,
-        "polyline": False,
-        "marker": False,
-    },
-    edit_options={"edit": True, "remove": True},
-).add_to(m)
-
-folium.LayerControl(collapsed=False).add_to(m)
+    ).add_to(fg)
+    return fg
+
+@st.cache_resource(max_entries=16)
+def load_radar_animation_layer(timecodes, display_times, opacity):
+    """Hoạt ảnh các khung radar (đã crop/lượng tử) qua URL tĩnh (không nhúng base64 vào HTML)
+
+    Chỉ cache khi mọi khung đều có URL; thiếu khung → ValueError (không cache lớp thiếu),
+    nơi gọi chuyển sang lớp 1 khung mới nhất.
+    """
+    fetcher = get_radar_fetcher()
+    frames, bounds = [], None
+    for timecode, label in zip(timecodes, display_times):
+        overlay = radar_overlay(timecode)
+        url = None if overlay is None else fetcher.frame_url(
+            timecode, kind="overlay", content=lambda overlay=overlay: overlay[0]
+        )
+        if url is None:
+            raise ValueError(f"chưa tải được khung radar {label}")
+        bounds = overlay[1]  # mọi khung cùng kích thước → cùng cửa sổ crop
+        frames.append((url, label))
+    return radar_animation_layer(
+        frames, f"🌧️ Radar {display_times[0]} → {display_times[-1]}", opacity, bounds
+    )
+
+show_radar_layer = show_radar and bool(loaded_radars)
+base_map, base_map_lock = load_base_map(use_vector_tiles, show_radar_layer)
+radar_layer = None
+if show_radar_layer and animate_radar:
+    try:
+        radar_layer = load_radar_animation_layer(
+            tuple(r[0] for r in loaded_radars), tuple(r[1] for r in loaded_radars), radar_opacity
+        )
+    except ValueError as e:
+        st.warning(f"⚠️ Không chạy được hoạt ảnh radar ({e}) → hiển thị 1 khung.")
+if show_radar_layer and radar_layer is None:
+    try:
+        radar_layer = load_radar_layer(timecode, display_time, radar_opacity)
+    except ValueError as e:
+        st.warning(f"⚠️ Không hiển thị được lớp radar: {e}")
 
 # =====================
 # 📝 Hướng dẫn
@@ -440,143 +455,238 @@ st.markdown("### ✏️ Hướng dẫn:")
 st.markdown("""
 - ☑️ Bật/tắt lớp **Radar** trong sidebar bên trái
 - 🎨 Điều chỉnh độ trong suốt của ảnh radar
+- 🎞️ Bật **Chạy vòng lặp radar** rồi dùng nút ⏮ ▶ ⏭ ở góc bản đồ để xem các khung
 - 📸 Nhấn **Chụp màn hình Radar** để lấy ảnh từ website (sẽ được chèn vào Excel)
+- 🖼️ Hoặc nhấn **Tạo ảnh từ dữ liệu radar** để crop nhanh ảnh radar đang chọn
+- 🎯 Nhấn **Lấy xã theo ngưỡng radar** để chọn sẵn các xã có dBZ vượt ngưỡng
 - ✏️ Dùng công cụ **Polygon** để vẽ vùng (double-click để kết thúc)
 - 📍 Có thể vẽ **nhiều vùng**
 - 🔄 Khi hoàn tất, nhấn **[Lấy xã]** để liệt kê các xã trong tất cả vùng đã vẽ
+- 📌 Hoặc tải lên **CSV tọa độ điểm** để lấy các xã chứa điểm (kèm số điểm từng xã)
 """)
 
 # =====================
 # 📍 Hiển thị bản đồ
 # =====================
-map_data = st_folium(m, height=600, width=950, returned_objects=["all_drawings"])
+layer_control = folium.LayerControl(collapsed=False)
+with base_map_lock, timed("map.st_folium"):
+    try:
+        map_data = st_folium(
+            base_map,
+            key="ban_do_nghe_an",
+            height=600,
+            width=950,
+            returned_objects=["all_drawings"],
+            feature_group_to_add=radar_layer,
+            layer_control=layer_control,
+        )
+    finally:
+        # Gỡ lớp radar + layer control mà st_folium vừa gắn tạm vào bản đồ dùng chung
+        for child in (radar_layer, layer_control):
+            if child is not None:
+                base_map._children.pop(child.get_name(), None)
 
 # =====================
 # 💾 Lưu các polygon
 # =====================
-if "all_polygons" not in st.session_state:
-    st.session_state.all_polygons = []
+# Session chỉ giữ WKB của các vùng + hash GeoJSON để phát hiện thay đổi (không giữ
+# GeoJSON thô hay object shapely) — hình học được dựng lại khi nhấn [Lấy xã]
+if "drawings" not in st.session_state:
+    st.session_state.drawings = ()
+    st.session_state.drawings_digest = None
+
+if "selection_memo" not in st.session_state:
+    # Ghi nhớ kết quả chọn xã theo vùng vẽ của session (chỉ tính lại vùng thêm/xóa)
+    st.session_state.selection_memo = SelectionMemo(commune_index)
 
 if map_data and "all_drawings" in map_data and map_data["all_drawings"]:
-    st.session_state.all_polygons = [
-        shape(feature["geometry"]) for feature in map_data["all_drawings"]
-        if feature.get("geometry") is not None
-    ]
+    # Chỉ dựng lại hình học khi các vùng vẽ thực sự thay đổi
+    drawings_digest = hashlib.sha1(
+        json.dumps(map_data["all_drawings"], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    if drawings_digest != st.session_state.drawings_digest:
+        st.session_state.drawings_digest = drawings_digest
+        st.session_state.drawings = polygons_to_wkb(polygons_from_geojson(map_data["all_drawings"]))
 
-st.info(f"📍 Hiện có **{len(st.session_state.all_polygons)}** vùng được vẽ.")
+st.info(f"📍 Hiện có **{len(st.session_state.drawings)}** vùng được vẽ.")
 
 # =====================
-# 🚀 Nút LẤY XÃ
+# 🗂️ Danh sách xã + xuất Excel (dùng chung cho mọi cách chọn xã)
 # =====================
-if st.button("📍 Lấy xã trong tất cả vùng đã vẽ"):
-    if st.session_state.all_polygons:
-        try:
-            union_polygon = unary_union(st.session_state.all_polygons)
-            selected_gdf = gdf[gdf.intersects(union_polygon)]
+def export_report(job, template, grouped_df, radar_buf):
+    """Việc nền: ghi template đã cache thẳng ra file lưu trữ → (đường dẫn, cỡ ảnh, lỗi ảnh)"""
+    job.update(progress=0.1, message="Đang ghi file Excel...")
+    return template.export(grouped_df, radar_buf, suffix=job.id[:8])
 
-            if not selected_gdf.empty:
-                st.success(f"✅ Tìm thấy {len(selected_gdf)} xã nằm trong các vùng đã vẽ.")
+def report_job_key(grouped_df, radar_id):
+    """Cùng danh sách xã + cùng ảnh radar → cùng key (gộp các lần bấm trùng)"""
+    digest = hashlib.sha1(grouped_df.to_csv(index=False).encode("utf-8")).hexdigest()
+    return f"report:{digest}:{radar_id}"
 
-                grouped_df = (
-                    selected_gdf.groupby("Diem")["Xa"]
-                    .apply(lambda x: ", ".join(sorted(set(x))))
-                    .reset_index()
-                )
+def show_selection(selected_gdf, source, grouped_df=None):
+    """Lưu danh sách xã theo huyện vào session và gửi việc tạo file Excel chạy nền"""
+    if selected_gdf.empty:
+        st.session_state.pop("selection", None)
+        st.warning(f"⚠️ Không có xã nào {source}.")
+        return
 
-                st.markdown("## 🗂️ Danh sách xã theo huyện")
-                for diem, xa_list in grouped_df.values:
-                    st.write(f"**{diem}**: {xa_list}")
-
-                # --- Ghi dữ liệu vào file template.xlsx
-                try:
-                    wb = load_workbook("template.xlsx")
-                    ws = wb.active
-
-                    # Bước 1: Lưu max_row của template trước khi xóa
-                    template_max_row = ws.max_row
-
-                    # Bước 2: Xóa dữ liệu cũ từ dòng 46
-                    clear_rows_from_46(ws)
-
-                    # Bước 3: Ghi dữ liệu mới từ dòng 46
-                    start_row = 46
-                    for i, row in enumerate(grouped_df.itertuples(index=False), start=start_row):
-                        write_to_merged_cell(ws, i, 1, row.Diem)
-                        write_to_merged_cell(ws, i, 3, row.Xa)
-
-                    # Bước 4: Ẩn/hiện dòng từ 60 đến template_max_row
-                    # Dòng đã ghi (≤ last_written_row): hiện — dòng chưa ghi: ẩn
-                    last_written_row = start_row + len(grouped_df) - 1
-                    for row_idx in range(60, template_max_row + 1):
-                        ws.row_dimensions[row_idx].hidden = (row_idx > last_written_row)
-
-                    # Bước 4: Chèn ảnh radar vào Excel (nếu đã chụp)
-                    radar_buf = st.session_state.get("radar_screenshot")
-                    if radar_buf:
-                        try:
-                            # ✅ TẠO BẢN SAO ĐỘC LẬP TỪ BYTES ĐỂ TRÁNH BỊ ĐÓNG FILE KHI LƯU
-                            img_data = io.BytesIO(radar_buf.getvalue())
-
-                            # Tính kích thước pixel khớp với vùng B14:G23
-                            from openpyxl.utils import column_index_from_string, get_column_letter
-
-                            START_COL, START_ROW = "B", 14
-                            END_COL,   END_ROW   = "F", 23
-
-                            def col_width_px(ws, col_letter):
-                                cd = ws.column_dimensions.get(col_letter)
-                                w = cd.width if cd and cd.width else 8.43
-                                return int(w * 7 + 5)
-
-                            def row_height_px(ws, row_num):
-                                rd = ws.row_dimensions.get(row_num)
-                                h = rd.height if rd and rd.height else 15
-                                return int(h * 96 / 72)
-
-                            sc = column_index_from_string(START_COL)
-                            ec = column_index_from_string(END_COL)
-                            total_w = sum(col_width_px(ws, get_column_letter(c)) for c in range(sc, ec + 1))
-                            total_h = sum(row_height_px(ws, r) for r in range(START_ROW, END_ROW + 1))
-
-                            # Sử dụng img_data thay vì radar_buf
-                            xl_img = XLImage(img_data)
-                            xl_img.anchor = RADAR_IMG_CELL
-                            xl_img.width  = total_w   # pixel width của vùng Excel
-                            xl_img.height = total_h   # pixel height của vùng Excel
-                            ws.add_image(xl_img)
-                            st.info(f"🖼️ Đã chèn ảnh radar vào vùng **B14:F23** ({total_w}×{total_h}px)")
-                        except Exception as img_err:
-                            st.warning(f"⚠️ Không thể chèn ảnh radar: {img_err}")
-                    else:
-                        st.info("ℹ️ Chưa có ảnh radar — nhấn **Chụp màn hình Radar** ở sidebar để thêm vào Excel.")
-
-                    # ✅ CHỈ LƯU WORKBOOK 1 LẦN VÀO RAM
-                    output = BytesIO()
-                    wb.save(output)
-                    excel_data = output.getvalue() # Lấy mảng byte an toàn
-                    
-                    now = datetime.now()
-                    filename_base = now.strftime("NGAN_DONG_%Y%m%d_%H%M")
-                    excel_filename = f"{filename_base}.xlsx"
-                    
-                    # ✅ LƯU RA DISK TỪ MẢNG BYTE (Tránh gọi wb.save lần 2 gây lỗi)
-                    with open(excel_filename, "wb") as f:
-                        f.write(excel_data)
-
-                    # Tải file xuống
-                    st.download_button(
-                        label="📥 Tải file Excel (theo template)",
-                        data=excel_data,
-                        file_name=excel_filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
-                except FileNotFoundError:
-                    st.error("❌ Không tìm thấy file 'template.xlsx' trong cùng thư mục.")
-            else:
-                st.warning("⚠️ Không có xã nào nằm trong các vùng đã vẽ.")
+    if grouped_df is None:
+        grouped_df = group_by_district(selected_gdf)
+
+    # --- Ghi dữ liệu vào file template.xlsx (xóa mẫu → ghi từ dòng 46 → ẩn dòng → chèn ảnh radar)
+    report_job = None
+    try:
+        template = load_report_template()
+        radar_buf = session_screenshot()
+        radar_id = st.session_state.get("radar_screenshot_id") if radar_buf is not None else None
+        report_job = get_job_executor().submit(
+            report_job_key(grouped_df, radar_id), "Tạo file Excel",
+            export_report, template, grouped_df, radar_buf,
+        ).id
+    except FileNotFoundError:
+        st.error("❌ Không tìm thấy file 'template.xlsx' trong cùng thư mục.")
+
+    # Giữ kết quả qua các lần rerun → vẫn tương tác bản đồ trong lúc file đang tạo
+    # (chỉ giữ số xã + các cặp (Diem, Xa) dạng chuỗi, không giữ DataFrame)
+    st.session_state.selection = {
+        "count": len(selected_gdf),
+        "source": source,
+        "districts": list(grouped_df.itertuples(index=False, name=None)),
+        "report_job": report_job,
+    }
+
+def show_report(job):
+    """Trạng thái file Excel: tiến độ khi đang tạo, nút tải xuống khi xong"""
+    if job is None:
+        st.warning("⚠️ File Excel đã hết hạn — nhấn lại nút lấy xã để tạo lại.")
+        return
+    if job.active:
+        show_job_progress(job)
+        return
+    if job.status == FAILED:
+        st.error(f"❌ Lỗi tạo file Excel: {job.error.splitlines()[0]}")
+        return
+
+    excel_path, image_size, image_err = job.result
+    if image_size:
+        st.info(f"🖼️ Đã chèn ảnh radar vào vùng **B14:F23** ({image_size[0]}×{image_size[1]}px)")
+    elif image_err:
+        st.warning(f"⚠️ Không thể chèn ảnh radar: {image_err}")
+    else:
+        st.info("ℹ️ Chưa có ảnh radar — nhấn **Chụp màn hình Radar** ở sidebar để thêm vào Excel.")
+
+    # Tải file xuống (đọc lại từ chính file lưu trữ)
+    try:
+        with open(excel_path, "rb") as excel_file:
+            st.download_button(
+                label="📥 Tải file Excel (theo template)",
+                data=excel_file,
+                file_name=os.path.basename(excel_path),
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+    except FileNotFoundError:
+        st.error(f"❌ Không tìm thấy file '{os.path.basename(excel_path)}' — nhấn lại nút lấy xã.")
+
+# =====================
+# 🚀 Nút LẤY XÃ
+# =====================
+# 📐 Lọc theo tỉ lệ diện tích xã nằm trong vùng vẽ (xã chỉ chạm cạnh vùng luôn bị loại)
+min_coverage = st.slider(
+    "Tỉ lệ diện tích xã nằm trong vùng vẽ tối thiểu (%)", 0, 100, 0, 5,
+    help="0% = mọi xã có một phần diện tích nằm trong vùng vẽ",
+)
+show_coverage = st.checkbox("Ghi kèm % diện tích của từng xã vào danh sách và file Excel", value=False)
+
+select_by_drawn = st.button("📍 Lấy xã trong tất cả vùng đã vẽ")
+
+# 📌 Danh sách điểm lat/lon (trạm đo mưa, điểm sự cố, điểm sơ tán...) → xã chứa từng điểm
+with st.expander("📌 Lấy xã theo danh sách điểm (CSV)"):
+    points_file = st.file_uploader(
+        "File CSV có cột lat/lon (hoặc vĩ độ/kinh độ)", type=["csv"],
+        help="Mỗi dòng 1 điểm; các cột khác được giữ nguyên trong file CSV đã gán xã",
+    )
+    show_point_counts = st.checkbox("Ghi kèm số điểm của từng xã vào danh sách và file Excel", value=True)
+    select_by_points = st.button("📌 Lấy xã chứa các điểm", disabled=points_file is None)
+
+if select_by_drawn:
+    if st.session_state.drawings:
+        try:
+            with timed("select.drawn"):
+                selected_gdf, grouped_df = st.session_state.selection_memo.select(
+                    polygons_from_wkb(st.session_state.drawings), min_coverage / 100, show_coverage
+                )
+            source = "nằm trong các vùng đã vẽ"
+            if min_coverage:
+                source += f" (≥ {min_coverage}% diện tích)"
+            show_selection(selected_gdf, source, grouped_df)
         except Exception as e:
             st.error(f"❌ Lỗi xử lý vùng vẽ: {e}")
     else:
         st.warning("⚠️ Bạn chưa vẽ vùng nào trên bản đồ.")
-else:
+elif select_by_radar:
+    try:
+        with timed("select.radar"):
+            selected_gdf, radar_stats = commune_radar_stats(timecode, dbz_threshold)
+        source = f"có phản hồi radar ≥ {dbz_threshold} dBZ lúc {display_time}"
+        if not radar_stats.empty:
+            with st.expander("📊 Cường độ radar theo xã", expanded=False):
+                st.dataframe(
+                    radar_stats.sort_values("max_dbz", ascending=False),
+                    hide_index=True,
+                    use_container_width=True,
+                )
+        show_selection(selected_gdf, source)
+    except Exception as e:
+        st.error(f"❌ Lỗi tính cường độ radar theo xã: {e}")
+elif select_by_points:
+    try:
+        with timed("select.points"):
+            points_df, lon, lat = read_points_csv(points_file)
+            selected_gdf, located = commune_index.select_points(lon, lat)
+        outside = int((located == NO_COMMUNE).sum())
+        if outside:
+            st.warning(f"⚠️ {outside}/{len(points_df)} điểm nằm ngoài lớp xã hoặc thiếu tọa độ.")
+        if not selected_gdf.empty:
+            with st.expander("📊 Số điểm theo huyện", expanded=False):
+                st.dataframe(count_points_by_district(selected_gdf), hide_index=True, use_container_width=True)
+                assigned = pd.concat(
+                    [points_df.reset_index(drop=True), commune_index.attributes_at(located)], axis=1
+                )
+                st.download_button(
+                    label="📥 Tải CSV điểm đã gán xã",
+                    data=assigned.to_csv(index=False).encode("utf-8-sig"),
+                    file_name=f"{os.path.splitext(points_file.name)[0]}_xa.csv",
+                    mime="text/csv",
+                )
+        source = f"chứa {len(points_df) - outside} điểm trong {points_file.name}"
+        show_selection(selected_gdf, source, group_by_district(selected_gdf, with_points=show_point_counts))
+    except (ValueError, UnicodeDecodeError) as e:
+        st.error(f"❌ Lỗi đọc file điểm: {e}")
+elif "selection" not in st.session_state:
     st.info("🖱️ Hãy vẽ vùng rồi nhấn **Lấy xã** để bắt đầu.")
+
+selection = st.session_state.get("selection")
+if selection:
+    st.success(f"✅ Tìm thấy {selection['count']} xã {selection['source']}.")
+    st.markdown("## 🗂️ Danh sách xã theo huyện")
+    for diem, xa_list in selection["districts"]:
+        st.write(f"**{diem}**: {xa_list}")
+    if selection["report_job"]:
+        poll_job(selection["report_job"], show_report)
+
+# =====================
+# ⏱️ Bảng đo hiệu năng (debug) — hiển thị cuối cùng để có số đo của lần chạy này
+# =====================
+if show_metrics:
+    with st.sidebar:
+        st.header("⏱️ Hiệu năng")
+        metrics_rows = METRICS.summary()
+        if metrics_rows:
+            st.dataframe(pd.DataFrame(metrics_rows), hide_index=True, use_container_width=True)
+            if not METRICS.write_summary():
+                st.caption(f"⚠️ Không ghi được {METRICS.summary_path}")
+        else:
+            st.caption("Chưa có số đo.")
+        if st.button("🔄 Xóa số đo", use_container_width=True):
+            METRICS.reset()
+            st.rerun()
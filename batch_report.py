@@ -0,0 +1,157 @@
+"""Tạo hàng loạt báo cáo NGAN_DONG_*.xlsx từ các file GeoJSON polygon (không cần giao diện).
+
+Mỗi file GeoJSON (giống data.geojson) → 1 báo cáo, các file được xử lý song song.
+File .csv được đọc như danh sách điểm lat/lon → báo cáo các xã chứa điểm.
+
+Ví dụ (chạy từ thư mục gốc repo):
+    python batch_report.py data.geojson
+    python batch_report.py vung_du_bao/*.geojson -o bao_cao -j 4 --radar-image radar.png
+    python batch_report.py tram_do_mua.csv --show-points
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from io import BytesIO
+
+from communes import (
+    COMMUNE_LAYER_PATH, CommuneIndex, group_by_district, load_communes, polygons_from_geojson, read_points_csv,
+)
+from report import TEMPLATE_PATH, ReportTemplate, report_filename
+
+# Lớp xã + template được nạp 1 lần cho mỗi process con
+_commune_index = None
+_report_template = None
+
+
+def _init_worker(layer_path, template_path):
+    global _commune_index, _report_template
+    _commune_index = CommuneIndex(load_communes(layer_path))
+    _report_template = ReportTemplate(template_path)
+
+
+def build_report(geojson_path, out_dir, now, radar_image=None, min_coverage=0.0, show_coverage=False,
+                 show_points=False, suffix=None):
+    """Tạo 1 báo cáo từ 1 file GeoJSON (hoặc CSV điểm) → (đường dẫn file, số xã)
+
+    `suffix` phân biệt tên báo cáo (mặc định: tên file đầu vào, xem `report_suffixes`).
+    """
+    if geojson_path.lower().endswith(".csv"):
+        _, lon, lat = read_points_csv(geojson_path)
+        selected_gdf, _ = _commune_index.select_points(lon, lat)
+    else:
+        with open(geojson_path, encoding="utf-8") as f:
+            polygons = polygons_from_geojson(json.load(f))
+        selected_gdf = _commune_index.select_covered(polygons, min_coverage)
+    if selected_gdf.empty:
+        return None, 0
+
+    grouped_df = group_by_district(selected_gdf, show_coverage, show_points)
+    suffix = suffix or os.path.splitext(os.path.basename(geojson_path))[0]
+    out_path = os.path.join(out_dir, report_filename(now, suffix=suffix))
+
+    radar_buf = None
+    if radar_image:
+        with open(radar_image, "rb") as f:
+            radar_buf = BytesIO(f.read())
+
+    _report_template.render(grouped_df, out_path, radar_buf)
+    return out_path, len(selected_gdf)
+
+
+def _expand_inputs(patterns):
+    paths, seen = [], set()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            key = os.path.normcase(os.path.abspath(path))
+            if key not in seen:  # cùng 1 file khớp nhiều pattern → chỉ 1 báo cáo
+                seen.add(key)
+                paths.append(path)
+    return paths
+
+
+def report_suffixes(paths):
+    """Hậu tố tên báo cáo cho từng file đầu vào, không trùng nhau trong cùng 1 lượt chạy
+
+    Mặc định là tên file (vd. a); các file trùng tên ở thư mục khác được thêm tên
+    thư mục cha (vung1_a, vung2_a), vẫn trùng nữa thì đánh số thứ tự.
+    """
+    def stem(path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def parent_stem(path):
+        parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        return f"{parent}_{stem(path)}" if parent else stem(path)
+
+    def collisions(names):
+        counts = {}
+        for name in names:
+            counts[name.lower()] = counts.get(name.lower(), 0) + 1
+        return counts
+
+    suffixes = [stem(path) for path in paths]
+    counts = collisions(suffixes)
+    suffixes = [
+        parent_stem(path) if counts[suffix.lower()] > 1 else suffix
+        for path, suffix in zip(paths, suffixes)
+    ]
+    counts = collisions(suffixes)
+    return [
+        f"{suffix}_{i + 1}" if counts[suffix.lower()] > 1 else suffix
+        for i, suffix in enumerate(suffixes)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tạo báo cáo NGAN_DONG_*.xlsx từ file GeoJSON polygon")
+    parser.add_argument("inputs", nargs="+", help="File GeoJSON hoặc CSV điểm lat/lon (hỗ trợ glob, vd: vung/*.geojson)")
+    parser.add_argument("-o", "--out-dir", default=".", help="Thư mục ghi báo cáo (mặc định: thư mục hiện tại)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Số process song song")
+    parser.add_argument("--layer", default=COMMUNE_LAYER_PATH, help="Lớp xã (mặc định: %(default)s)")
+    parser.add_argument("--template", default=TEMPLATE_PATH, help="Template Excel (mặc định: %(default)s)")
+    parser.add_argument("--radar-image", help="Ảnh radar PNG chèn vào vùng B14:F23 (tuỳ chọn)")
+    parser.add_argument("--min-coverage", type=float, default=0.0,
+                        help="Tỉ lệ diện tích xã nằm trong vùng tối thiểu, %% (mặc định: %(default)s)")
+    parser.add_argument("--show-coverage", action="store_true", help="Ghi kèm %% diện tích sau tên xã")
+    parser.add_argument("--show-points", action="store_true", help="CSV điểm: ghi kèm số điểm sau tên xã")
+    args = parser.parse_args(argv)
+
+    inputs = _expand_inputs(args.inputs)
+    suffixes = report_suffixes(inputs)
+    os.makedirs(args.out_dir, exist_ok=True)
+    now = datetime.now()
+
+    failed = 0
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(args.jobs or 1, len(inputs))),
+        initializer=_init_worker,
+        initargs=(args.layer, args.template),
+    ) as executor:
+        futures = {
+            executor.submit(
+                build_report, path, args.out_dir, now, args.radar_image,
+                args.min_coverage / 100, args.show_coverage, args.show_points, suffix,
+            ): path
+            for path, suffix in zip(inputs, suffixes)
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                out_path, n_communes = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"❌ {path}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            if out_path:
+                print(f"✅ {path}: {n_communes} xã → {out_path}")
+            else:
+                print(f"⚠️ {path}: không có xã nào nằm trong các vùng")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
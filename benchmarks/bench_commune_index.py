@@ -0,0 +1,71 @@
+"""Đo thời gian bước [Lấy xã]: unary_union + gdf.intersects so với CommuneIndex.
+
+Chạy từ thư mục gốc repo:
+    python benchmarks/bench_commune_index.py
+"""
+import os
+import sys
+import time
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Polygon
+from shapely.ops import unary_union
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from communes import CommuneIndex  # noqa: E402
+
+POLYGON_COUNTS = [1, 5, 20, 50]
+VERTEX_COUNTS = [16, 256, 1024, 2048]
+REPEAT = 3
+
+
+def make_polygons(bounds, n_polygons, n_vertices, seed=0):
+    """Sinh n polygon hình sao (có răng cưa) ngẫu nhiên trong bbox của lớp xã"""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+    polys = []
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    for _ in range(n_polygons):
+        cx = rng.uniform(minx, maxx)
+        cy = rng.uniform(miny, maxy)
+        r = rng.uniform(0.05, 0.3) * (1 + 0.3 * rng.standard_normal(n_vertices).clip(-2, 2))
+        xs = cx + r * np.cos(angles)
+        ys = cy + r * np.sin(angles)
+        polys.append(Polygon(np.column_stack([xs, ys])).buffer(0))
+    return polys
+
+
+def best_of(fn):
+    times = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main():
+    gdf = gpd.read_file(os.path.join(ROOT, "Xa_NA_chuan.shp")).to_crs(epsg=4326)
+
+    t0 = time.perf_counter()
+    index = CommuneIndex(gdf)
+    print(f"Dựng CommuneIndex: {(time.perf_counter() - t0) * 1000:.1f} ms ({len(gdf)} xã)\n")
+
+    print(f"{'polygons':>8} {'vertices':>8} {'scan (ms)':>10} {'index (ms)':>11} {'speedup':>8}")
+    for n_vertices in VERTEX_COUNTS:
+        for n_polygons in POLYGON_COUNTS:
+            polys = make_polygons(gdf.total_bounds, n_polygons, n_vertices)
+
+            t_scan, scan = best_of(lambda: gdf[gdf.intersects(unary_union(polys))])
+            t_index, indexed = best_of(lambda: index.select(polys))
+            assert list(scan.index) == list(indexed.index), "Kết quả không khớp"
+
+            print(f"{n_polygons:>8} {n_vertices:>8} {t_scan * 1000:>10.1f} "
+                  f"{t_index * 1000:>11.1f} {t_scan / max(t_index, 1e-9):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
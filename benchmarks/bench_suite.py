@@ -0,0 +1,298 @@
+"""Bộ benchmark chạy offline cho các bước nóng của app, lưu kết quả để so sánh giữa các commit.
+
+Dữ liệu dùng: shapefile Xa_NA_chuan, template.xlsx, ảnh radar_analysis_*.png, data.geojson
+và polygon sinh ngẫu nhiên (cố định seed). Phần tải radar chạy qua 1 HTTP server giả lập
+hymetnet trên localhost (có độ trễ) → không cần mạng.
+
+Chạy từ thư mục gốc repo:
+    python benchmarks/bench_suite.py                      # chạy tất cả, ghi benchmarks/results/
+    python benchmarks/bench_suite.py -k excel -k radar    # chỉ chạy nhóm có tên chứa "excel"/"radar"
+    python benchmarks/bench_suite.py --compare benchmarks/results/<file cũ>.json
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # các module của app dùng đường dẫn tương đối (template.xlsx, lớp xã...)
+
+import radar  # noqa: E402
+from bench_commune_index import make_polygons  # noqa: E402
+from communes import (  # noqa: E402
+    CommuneIndex, SelectionMemo, build_display_layer, display_level_for_zoom,
+    group_by_district, load_communes, polygons_from_geojson, read_commune_source,
+)
+from radar_image import (  # noqa: E402
+    CommuneRadarStats, RadarComposer, crop_radar_png, decode_dbz_levels, transcode_frame,
+)
+from report import ReportTemplate  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+RADAR_SAMPLES = sorted(glob.glob(os.path.join(ROOT, "radar_analysis_*.png")))
+CROP_BOUNDS = (103.5, 18.3, 106.1, 20.5)  # giống vùng crop trong capture.py
+
+REPEAT = 5
+POLYGON_CASES = [(1, 16), (5, 256), (20, 256), (50, 1024)]  # (số polygon, số đỉnh)
+POINT_COUNT = 100_000
+STUB_LATENCY = 0.05     # giây — độ trễ giả lập mỗi request tới hymetnet
+FETCH_FRAMES = 18       # 3 giờ khung radar
+FETCH_WORKERS = [1, 4, radar.FETCH_WORKERS]
+
+
+# =====================
+# ⏱️ ĐO THỜI GIAN
+# =====================
+class Bench:
+    """Gom kết quả các phép đo: tên → best/median (ms)"""
+
+    def __init__(self, repeat=REPEAT, filters=None):
+        self.repeat = repeat
+        self.filters = filters or []
+        self.results = {}
+
+    def enabled(self, group):
+        return not self.filters or any(f in group for f in self.filters)
+
+    def run(self, name, fn, repeat=None, setup=None):
+        times = []
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            t0 = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - t0) * 1000)
+        self.results[name] = {"best_ms": round(min(times), 3), "median_ms": round(float(np.median(times)), 3)}
+        print(f"  {name:<45} {min(times):>10.2f} {np.median(times):>10.2f}")
+
+
+# =====================
+# 🧪 CÁC NHÓM BENCHMARK
+# =====================
+def bench_communes(bench):
+    bench.run("communes.read_source (GDAL + to_crs)", read_commune_source, repeat=3)
+    cache_dir = tempfile.mkdtemp(prefix="bench_communes_")
+    load_communes(cache_dir=cache_dir)  # tạo cache 1 lần
+    bench.run("communes.read_cache (GeoParquet)", lambda: load_communes(cache_dir=cache_dir))
+
+
+def bench_selection(bench, gdf):
+    with open(os.path.join(ROOT, "data.geojson"), encoding="utf-8") as f:
+        sample = polygons_from_geojson(json.load(f))
+
+    # STRtree chỉ thực sự dựng ở lần query đầu → đo cả lần query đó
+    bench.run("selection.build_index", lambda: CommuneIndex(gdf).query(sample), repeat=3)
+    index = CommuneIndex(gdf)
+    bench.run("selection.data_geojson", lambda: index.select(sample))
+
+    for n_polygons, n_vertices in POLYGON_CASES:
+        polys = make_polygons(gdf.total_bounds, n_polygons, n_vertices)
+        bench.run(f"selection.select[{n_polygons}x{n_vertices}]", lambda: index.select(polys))
+    index.coverage(sample)  # chiếu lớp xã sang hệ đồng diện tích 1 lần
+    for n_polygons, n_vertices in POLYGON_CASES[:3]:
+        polys = make_polygons(gdf.total_bounds, n_polygons, n_vertices)
+        bench.run(f"selection.coverage[{n_polygons}x{n_vertices}]", lambda: index.coverage(polys))
+
+    # Thêm 1 vùng vào 49 vùng đã ghi nhớ → chỉ tính vùng mới
+    polys = make_polygons(gdf.total_bounds, 50, 256)
+    memo = SelectionMemo(index)
+    bench.run(
+        "selection.memo_add_one[50x256]",
+        lambda: memo.select(polys),
+        setup=lambda: memo.select(polys[:-1]),
+    )
+    bench.run(
+        "selection.memo_add_one_coverage[50x256]",
+        lambda: memo.select(polys, 0.0),
+        setup=lambda: memo.select(polys[:-1], 0.0),
+    )
+    selected = index.select(polys)
+    bench.run("selection.group_by_district", lambda: group_by_district(selected))
+
+    # Gán 100k điểm ngẫu nhiên trong bbox lớp xã vào xã chứa điểm
+    minx, miny, maxx, maxy = gdf.total_bounds
+    rng = np.random.default_rng(0)
+    lon, lat = rng.uniform(minx, maxx, POINT_COUNT), rng.uniform(miny, maxy, POINT_COUNT)
+    bench.run(f"selection.select_points[{POINT_COUNT}]", lambda: index.select_points(lon, lat))
+
+
+def bench_geojson(bench, gdf):
+    import folium
+    from streamlit_folium import generate_leaflet_string
+
+    bench.run("geojson.gdf_to_json (full)", gdf.to_json, repeat=3)
+    level = display_level_for_zoom(9)
+    bench.run("geojson.build_display_layer_z9", lambda: build_display_layer(gdf, level), repeat=3)
+    layer = build_display_layer(gdf, level)
+    bench.run("geojson.dumps_display_z9", lambda: json.dumps(layer))
+
+    def render_map():
+        m = folium.Map(location=[19.23, 104.8], zoom_start=9)
+        folium.GeoJson(layer, name="xa").add_to(m)
+        m.get_root().render()
+        return generate_leaflet_string(m)
+
+    bench.run("geojson.folium_render_z9", render_map, repeat=3)
+
+
+def bench_excel(bench, gdf):
+    index = CommuneIndex(gdf)
+    grouped = group_by_district(index.select(make_polygons(gdf.total_bounds, 20, 256)))
+    bench.run("excel.load_template", ReportTemplate, repeat=3)
+    template = ReportTemplate()
+    bench.run("excel.render (no image)", lambda: template.render(grouped, io.BytesIO()))
+    if RADAR_SAMPLES:
+        with open(RADAR_SAMPLES[0], "rb") as f:
+            radar_buf = io.BytesIO(f.read())
+        bench.run("excel.render (radar image)", lambda: template.render(grouped, io.BytesIO(), radar_buf))
+
+
+def bench_radar_image(bench, gdf):
+    if not RADAR_SAMPLES:
+        print("  (không có radar_analysis_*.png — bỏ qua)")
+        return
+    with open(RADAR_SAMPLES[0], "rb") as f:
+        png = f.read()
+    bench.run("radar.decode_dbz_levels", lambda: decode_dbz_levels(png))
+    bench.run("radar.crop", lambda: crop_radar_png(png, CROP_BOUNDS))
+    commune_bounds = tuple(gdf.total_bounds)
+    bench.run("radar.transcode_frame", lambda: transcode_frame(png, commune_bounds))
+    composer = RadarComposer(gdf)
+    composer.compose(png, CROP_BOUNDS)  # tạo nền xã 1 lần
+    bench.run("radar.compose (cached basemap)", lambda: composer.compose(png, CROP_BOUNDS))
+    stats = CommuneRadarStats(gdf)
+    stats.compute(png)  # raster hóa lớp xã 1 lần
+    bench.run("radar.commune_stats", lambda: stats.compute(png))
+
+
+# =====================
+# 🌐 SERVER GIẢ LẬP HYMETNET
+# =====================
+def _stub_handler(payload, latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def bench_fetch(bench):
+    payload = open(RADAR_SAMPLES[0], "rb").read() if RADAR_SAMPLES else b"\x89PNG" + b"0" * 200_000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _stub_handler(payload, STUB_LATENCY))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = radar.RADAR_BASE_URL
+    radar.RADAR_BASE_URL = f"http://127.0.0.1:{server.server_port}/VIN"
+    try:
+        for workers in FETCH_WORKERS:
+            fetcher = None
+
+            def fresh_fetcher(workers=workers):
+                nonlocal fetcher
+                fetcher = radar.RadarFetcher(workers=workers)  # cache rỗng → tải lại hết
+
+            bench.run(
+                f"fetch.load_frames[{FETCH_FRAMES} frames, {workers} workers]",
+                lambda: fetcher.load_frames(FETCH_FRAMES),
+                repeat=3,
+                setup=fresh_fetcher,
+            )
+        bench.run(f"fetch.load_frames[{FETCH_FRAMES} frames, cached]", lambda: fetcher.load_frames(FETCH_FRAMES))
+    finally:
+        radar.RADAR_BASE_URL = base_url
+        server.shutdown()
+
+
+# =====================
+# 💾 LƯU / SO SÁNH KẾT QUẢ
+# =====================
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results, out_dir=RESULTS_DIR):
+    commit = _git_commit()
+    now = datetime.now()
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{now:%Y%m%d_%H%M%S}_{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "created_at": now.isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }, f, indent=1, ensure_ascii=False)
+    return path
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nSo với {os.path.basename(baseline_path)} (commit {baseline.get('commit')}):")
+    print(f"  {'benchmark':<45} {'cũ (ms)':>10} {'mới (ms)':>10} {'tỉ lệ':>8}")
+    for name, value in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        ratio = value["best_ms"] / max(old["best_ms"], 1e-9)
+        flag = "  ⚠️" if ratio > 1.2 else ""
+        print(f"  {name:<45} {old['best_ms']:>10.2f} {value['best_ms']:>10.2f} {ratio:>7.2f}x{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline các bước nóng của app")
+    parser.add_argument("-k", dest="filters", action="append", help="Chỉ chạy nhóm có tên chứa chuỗi này")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Số lần lặp mỗi phép đo")
+    parser.add_argument("--compare", help="File kết quả cũ để so sánh")
+    parser.add_argument("--no-save", action="store_true", help="Không ghi kết quả ra benchmarks/results/")
+    args = parser.parse_args(argv)
+
+    bench = Bench(args.repeat, args.filters)
+    gdf = load_communes()
+    groups = [
+        ("communes", lambda: bench_communes(bench)),
+        ("selection", lambda: bench_selection(bench, gdf)),
+        ("geojson", lambda: bench_geojson(bench, gdf)),
+        ("excel", lambda: bench_excel(bench, gdf)),
+        ("radar", lambda: bench_radar_image(bench, gdf)),
+        ("fetch", lambda: bench_fetch(bench)),
+    ]
+    print(f"  {'benchmark':<45} {'best (ms)':>10} {'median':>10}")
+    for group, fn in groups:
+        if bench.enabled(group):
+            print(f"[{group}]")
+            fn()
+
+    if not args.no_save:
+        print(f"\n💾 Đã lưu: {save_results(bench.results)}")
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
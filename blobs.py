@@ -0,0 +1,69 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# =====================
+# ⚙️ CẤU HÌNH KHO DỮ LIỆU CHUNG
+# =====================
+BLOB_MAX_BYTES = 64 * 1024 * 1024   # tổng dung lượng ảnh giữ lại cho mọi session
+BLOB_MAX_ITEMS = 256
+
+
+def blob_id(data):
+    """Khóa theo nội dung: cùng bytes → cùng id (dùng chung giữa các session)"""
+    return hashlib.sha1(data).hexdigest()
+
+
+# =====================
+# 🗄️ KHO BYTES THEO NỘI DUNG (LRU, dùng chung mọi session trong process)
+# =====================
+class BlobStore:
+    """Lưu bytes (ảnh radar đã chụp/ghép...) 1 lần theo hash, session chỉ giữ id
+
+    Giới hạn theo số mục và tổng dung lượng, bỏ mục dùng lâu nhất trước;
+    id đã bị bỏ → get() trả về None, session coi như chưa có dữ liệu.
+    """
+
+    def __init__(self, max_bytes=BLOB_MAX_BYTES, max_items=BLOB_MAX_ITEMS):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, data):
+        """Lưu bytes / BytesIO → id nội dung"""
+        if hasattr(data, "getvalue"):
+            data = data.getvalue()
+        data = bytes(data)
+        key = blob_id(data)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return key
+            self._items[key] = data
+            self.total_bytes += len(data)
+            # Luôn giữ mục vừa thêm, kể cả khi riêng nó vượt giới hạn
+            while len(self._items) > 1 and (
+                len(self._items) > self.max_items or self.total_bytes > self.max_bytes
+            ):
+                _, evicted = self._items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return key
+
+    def get(self, key):
+        """Bytes theo id (None nếu không có / đã bị bỏ khỏi kho)"""
+        if key is None:
+            return None
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
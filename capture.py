@@ -0,0 +1,202 @@
+import asyncio
+import io
+import subprocess
+import threading
+import traceback
+
+from metrics import timed
+
+# =====================
+# ⚙️ CẤU HÌNH CHỤP RADAR
+# =====================
+RADAR_URL = "https://iweather.gov.vn/dashboard/?productRadar=CMAX&areaRadar=VIN"
+
+# Vùng cần crop (tọa độ địa lý)
+CROP_MIN_LAT = 18.3
+CROP_MAX_LAT = 20.5
+CROP_MIN_LON = 103.5
+CROP_MAX_LON = 106.1
+
+DEVICE_SCALE = 3          # ↑ 3x → ảnh sắc nét hơn nhiều
+POOL_SIZE = 1             # số trang "ấm" — app chỉ chạy 1 việc chụp tại 1 thời điểm (job key "capture")
+IDLE_TIMEOUT = 15000      # ms — chờ tối đa map/tiles tải xong sau mỗi thao tác
+
+SCROLL_TIMES = 2          # tăng nếu muốn zoom sâu hơn
+SCROLL_DELTA = -300       # âm = lên = zoom in
+
+BROWSER_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--no-sandbox",           # Bắt buộc trên Linux Container
+    "--disable-gpu",          # Giúp ổn định hơn trên server
+    "--disable-dev-shm-usage",  # Tránh lỗi bộ nhớ đệm trên Docker
+]
+
+# Tìm đối tượng Leaflet map trên trang và giữ lại ở window.__radarMap
+FIND_MAP_JS = """() => {
+    if (window.__radarMap) return true;
+    let map = null;
+    if (window._map && window._map.setView) map = window._map;
+    else if (window.map && window.map.setView) map = window.map;
+    if (!map) {
+        for (const key of Object.keys(window)) {
+            const obj = window[key];
+            if (obj && typeof obj === 'object' && obj.fitBounds && obj.setView) {
+                map = obj; break;
+            }
+        }
+    }
+    if (!map) {
+        const el = document.querySelector('.leaflet-container');
+        if (el && el._leaflet_map) map = el._leaflet_map;
+    }
+    window.__radarMap = map;
+    return !!map;
+}"""
+
+# Chờ theo sự kiện: hết animation zoom/pan và không còn tile layer nào đang tải
+WAIT_MAP_IDLE_JS = """(timeoutMs) => new Promise(resolve => {
+    const map = window.__radarMap;
+    const start = performance.now();
+    const busy = () => map && (map._animatingZoom || map._panAnim && map._panAnim._inProgress ||
+        Object.values(map._layers || {}).some(l => l._loading));
+    const check = () => {
+        if (!busy() || performance.now() - start > timeoutMs) resolve(true);
+        else requestAnimationFrame(check);
+    };
+    requestAnimationFrame(check);
+})"""
+
+SET_VIEW_JS = """([lat, lon, targetZoom]) => {
+    const map = window.__radarMap;
+    if (!map) return -1;
+    // Chỉ zoom IN — không bao giờ zoom out
+    const newZoom = Math.max(map.getZoom(), targetZoom);
+    map.setView([lat, lon], newZoom, { animate: false });
+    return newZoom;
+}"""
+
+
+class _WarmPage:
+    """Trang radar đã mở sẵn (tránh khởi động trình duyệt + tải nguội mỗi lần chụp)"""
+
+    def __init__(self, page):
+        self.page = page
+        self.box = None
+
+
+# =====================
+# 📸 DỊCH VỤ CHỤP RADAR CHẠY NỀN
+# =====================
+class RadarCaptureService:
+    """Giữ 1 Chromium + trang radar "ấm" trên 1 event loop chạy nền
+
+    Mỗi lần chụp lấy 1 trang rảnh, luôn tải lại dữ liệu radar mới nhất và đưa map
+    về vùng crop rồi mới chụp — trang ấm chỉ giúp bỏ qua bước mở trình duyệt.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="radar-capture", daemon=True)
+        self._thread.start()
+        self._ready = asyncio.run_coroutine_threadsafe(self._start(), self._loop)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _start(self):
+        """Cài Chromium (1 lần), mở trình duyệt và mở sẵn trang radar (chưa zoom/crop)"""
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError:
+            return "❌ Chưa cài Playwright trong requirements.txt"
+
+        try:
+            # Tự động cài đặt chromium nếu chưa có (dành cho Streamlit Cloud) — chỉ lúc khởi động
+            with timed("capture.install"):
+                await asyncio.to_thread(subprocess.run, ["playwright", "install", "chromium"], check=False)
+
+            with timed("capture.launch"):
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+                self._context = await self._browser.new_context(
+                    viewport={"width": 1920, "height": 1080},
+                    device_scale_factor=DEVICE_SCALE,
+                    user_agent="Mozilla/5.0",
+                )
+            self._pages = asyncio.Queue()
+            for _ in range(self.pool_size):
+                warm = _WarmPage(await self._context.new_page())
+                # Chỉ tải trang 1 lần để nạp sẵn cache HTTP (JS/CSS/tiles nền); zoom + đưa map
+                # về vùng crop để dành cho _refresh lúc chụp vì lần chụp nào cũng tải lại
+                try:
+                    with timed("capture.prefetch"):
+                        await warm.page.goto(RADAR_URL, wait_until="domcontentloaded", timeout=60000)
+                except Exception:
+                    pass  # website radar chưa sẵn sàng → lần chụp đầu tự tải
+                self._pages.put_nowait(warm)
+            return None
+        except Exception as e:
+            return f"❌ Lỗi Playwright: {type(e).__name__}: {str(e)}\n\n{traceback.format_exc()}"
+
+    async def _wait_idle(self, page):
+        with timed("capture.wait_idle"):
+            try:
+                await page.wait_for_load_state("networkidle", timeout=IDLE_TIMEOUT)
+            except Exception:
+                pass  # trang radar có thể giữ kết nối lâu dài → vẫn kiểm tra map bên dưới
+            await page.evaluate(WAIT_MAP_IDLE_JS, IDLE_TIMEOUT)
+
+    async def _refresh(self, warm):
+        """Tải (lại) trang radar và đưa map về vùng crop"""
+        page = warm.page
+        with timed("capture.goto"):
+            await page.goto(RADAR_URL, wait_until="domcontentloaded", timeout=60000)
+        with timed("capture.wait_map"):
+            await page.wait_for_selector("canvas", timeout=20000)
+            map_el = await page.wait_for_selector(".leaflet-container", timeout=20000)
+            await page.wait_for_function(FIND_MAP_JS, timeout=20000)
+
+        # ✅ Zoom IN Leaflet vào tâm vùng cần chụp (không dùng fitBounds để tránh zoom out)
+        center_lat = (CROP_MIN_LAT + CROP_MAX_LAT) / 2
+        center_lon = (CROP_MIN_LON + CROP_MAX_LON) / 2
+        await page.evaluate(SET_VIEW_JS, [center_lat, center_lon, 8])
+        await self._wait_idle(page)
+
+        # 🖱️ Focus vào map + scroll zoom IN thêm
+        box = await map_el.bounding_box()
+        cx = box["x"] + box["width"] / 2 + 30
+        cy = box["y"] + box["height"] / 2 - 100
+        await page.mouse.click(cx, cy)
+        for _ in range(SCROLL_TIMES):
+            await page.mouse.wheel(0, SCROLL_DELTA)
+            await self._wait_idle(page)
+
+        warm.box = await map_el.bounding_box()
+
+    async def _capture(self):
+        warm = await self._pages.get()
+        try:
+            # Luôn tải lại để có frame radar mới nhất (_refresh chờ map/tiles idle xong mới trả về)
+            await self._refresh(warm)
+
+            # Chụp đúng vùng map element (không cần chụp full rồi crop)
+            with timed("capture.screenshot"):
+                png = await warm.page.screenshot(type="png", scale="device", clip=warm.box)
+            return io.BytesIO(png), None
+        except Exception as e:
+            return None, f"❌ Lỗi Playwright: {type(e).__name__}: {str(e)}\n\n{traceback.format_exc()}"
+        finally:
+            self._pages.put_nowait(warm)
+
+    def capture(self, timeout=120):
+        """Chụp ảnh radar đã crop → (BytesIO PNG, thông báo lỗi hoặc None)"""
+        start_err = self._ready.result(timeout=timeout)
+        if start_err:
+            # Khởi động lỗi → lần bấm sau thử khởi động lại
+            self._ready = asyncio.run_coroutine_threadsafe(self._start(), self._loop)
+            return None, start_err
+        with timed("capture.total"):
+            future = asyncio.run_coroutine_threadsafe(self._capture(), self._loop)
+            return future.result(timeout=timeout)
@@ -0,0 +1,566 @@
+import glob
+import hashlib
+import os
+import sys
+import unicodedata
+from functools import lru_cache
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+from metrics import timed
+
+COMMUNE_LAYER_PATH = "Xa_NA_chuan.shp"
+
+# Cache nhị phân (GeoParquet: hình học WKB + thuộc tính + bbox, đã ở EPSG:4326)
+COMMUNE_CACHE_DIR = os.path.join(".cache", "communes")
+COMMUNE_CACHE_VERSION = 1  # tăng khi đổi cấu trúc file cache
+SHAPEFILE_PARTS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+BBOX_COLUMNS = ["minx", "miny", "maxx", "maxy"]
+
+# Phép chiếu đồng diện tích (Lambert azimuthal equal-area, tâm Nghệ An) để tính tỉ lệ diện tích
+EQUAL_AREA_CRS = "+proj=laea +lat_0=19.2 +lon_0=104.9 +datum=WGS84 +units=m +no_defs"
+COVERAGE_EPSILON = 1e-6  # tỉ lệ nhỏ hơn → coi như chỉ chạm cạnh, không tính
+
+# Tên cột tọa độ chấp nhận trong CSV điểm (so sánh sau khi bỏ dấu, chữ thường, bỏ khoảng trắng/_)
+POINT_LAT_COLUMNS = ("lat", "latitude", "vido", "y")
+POINT_LON_COLUMNS = ("lon", "lng", "long", "longitude", "kinhdo", "x")
+NO_COMMUNE = -1  # điểm nằm ngoài lớp xã
+
+
+# =====================
+# ⚙️ ĐỌC LỚP XÃ / POLYGON ĐẦU VÀO
+# =====================
+def _source_files(path):
+    """Các file tạo nên lớp nguồn (shapefile gồm nhiều file đi kèm)"""
+    stem, ext = os.path.splitext(path)
+    if ext.lower() != ".shp":
+        return [path]
+    return [stem + part for part in SHAPEFILE_PARTS if os.path.exists(stem + part)]
+
+
+def source_fingerprint(path):
+    """Hash nội dung lớp nguồn → tên file cache (đổi shapefile là tự tạo lại cache)"""
+    h = hashlib.sha1(f"v{COMMUNE_CACHE_VERSION}".encode())
+    for part in _source_files(path):
+        h.update(os.path.splitext(part)[1].lower().encode())
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def read_commune_source(path=COMMUNE_LAYER_PATH):
+    """Đọc lớp xã gốc qua GDAL và chuyển về EPSG:4326 (chậm — chỉ dùng khi tạo cache)"""
+    with timed("communes.read_source"):
+        gdf = gpd.read_file(path)
+        return gdf.to_crs(epsg=4326)
+
+
+def _commune_cache_path(path, cache_dir):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{stem}-{source_fingerprint(path)}.parquet")
+
+
+def write_commune_cache(gdf, cache_path):
+    """Ghi lớp xã đã đọc từ nguồn ra file GeoParquet kèm cột bbox → đường dẫn file cache
+
+    OSError (thư mục chỉ đọc, đầy đĩa...) được raise lại cho nơi gọi tự xử lý.
+    """
+    cache_dir = os.path.dirname(cache_path) or "."
+    stem = os.path.basename(cache_path).rsplit("-", 1)[0]
+
+    gdf = gdf.copy()
+    bounds = shapely.bounds(np.asarray(gdf.geometry.values, dtype=object))
+    for i, col in enumerate(BBOX_COLUMNS):
+        gdf[col] = bounds[:, i]
+
+    # Ghi ra file tạm rồi đổi tên → process khác không bao giờ đọc phải file ghi dở
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        gdf.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    # Xóa cache của các phiên bản shapefile cũ
+    for old in glob.glob(os.path.join(cache_dir, f"{stem}-*.parquet")):
+        if old != cache_path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return cache_path
+
+
+def build_commune_cache(path=COMMUNE_LAYER_PATH, cache_dir=COMMUNE_CACHE_DIR):
+    """Đọc lớp gốc, ghi file GeoParquet kèm cột bbox → đường dẫn file cache"""
+    return write_commune_cache(read_commune_source(path), _commune_cache_path(path, cache_dir))
+
+
+def load_communes(path=COMMUNE_LAYER_PATH, cache_dir=COMMUNE_CACHE_DIR):
+    """Đọc lớp xã Nghệ An (EPSG:4326) từ cache GeoParquet, tạo cache nếu chưa có/đã cũ
+
+    Cache gồm hình học WKB, các cột thuộc tính và bbox từng xã (minx, miny, maxx, maxy);
+    đọc bằng memory map nên khởi động nguội không phải qua GDAL + chuyển hệ tọa độ.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return read_commune_source(path)  # chưa cài pyarrow → đọc trực tiếp như cũ
+
+    cache_path = _commune_cache_path(path, cache_dir)
+    if not os.path.exists(cache_path):
+        gdf = read_commune_source(path)
+        try:
+            write_commune_cache(gdf, cache_path)
+        except OSError as e:
+            # Thư mục app chỉ đọc (container autoscale...) → dùng luôn lớp vừa đọc như cũ
+            print(f"⚠️ Không ghi được cache lớp xã vào {cache_dir}: {e}", file=sys.stderr)
+            return gdf
+    with timed("communes.read_cache"):
+        return gpd.read_parquet(cache_path, memory_map=True)
+
+
+def polygons_from_geojson(data):
+    """FeatureCollection / Feature / list feature / geometry → list hình học shapely"""
+    if isinstance(data, dict) and data.get("type") == "FeatureCollection":
+        data = data.get("features", [])
+    if isinstance(data, dict):
+        data = [data]
+    polygons = []
+    for item in data:
+        geometry = item.get("geometry") if item.get("type") == "Feature" else item
+        if geometry is not None:
+            polygons.append(shape(geometry))
+    return polygons
+
+
+def _column_key(name):
+    """"Vĩ độ" / "vi_do" / "Vi Do" → "vido" để so khớp tên cột tọa độ"""
+    text = unicodedata.normalize("NFKD", str(name).strip().lower().replace("đ", "d"))
+    return "".join(c for c in text if c.isalnum() and not unicodedata.combining(c))
+
+
+def read_points_csv(source):
+    """CSV điểm (file/đường dẫn) → (DataFrame gốc, mảng lon, mảng lat)
+
+    Tự nhận cột tọa độ theo POINT_LAT_COLUMNS / POINT_LON_COLUMNS; ô không phải số → NaN.
+    """
+    df = pd.read_csv(source)
+    keys = {_column_key(c): c for c in df.columns}
+    lat_col = next((keys[k] for k in POINT_LAT_COLUMNS if k in keys), None)
+    lon_col = next((keys[k] for k in POINT_LON_COLUMNS if k in keys), None)
+    if lat_col is None or lon_col is None:
+        raise ValueError(
+            f"không tìm thấy cột tọa độ (cần 1 trong {POINT_LAT_COLUMNS} và 1 trong {POINT_LON_COLUMNS})"
+        )
+    lon = pd.to_numeric(df[lon_col], errors="coerce").to_numpy(dtype=float)
+    lat = pd.to_numeric(df[lat_col], errors="coerce").to_numpy(dtype=float)
+    return df, lon, lat
+
+
+def polygons_to_wkb(polygons):
+    """List hình học → tuple WKB (gọn để giữ trong session, không giữ object shapely)"""
+    return tuple(shapely.to_wkb(np.asarray(polygons, dtype=object)))
+
+
+def polygons_from_wkb(blobs):
+    """Tuple WKB → list hình học shapely (dựng lại khi cần tính toán)"""
+    return list(shapely.from_wkb(np.asarray(blobs, dtype=object))) if blobs else []
+
+# =====================
+# 📐 CHIẾU ĐỒNG DIỆN TÍCH
+# =====================
+@lru_cache(maxsize=1)
+def _equal_area_transformer():
+    from pyproj import Transformer
+
+    return Transformer.from_crs("EPSG:4326", EQUAL_AREA_CRS, always_xy=True)
+
+
+def to_equal_area(geoms):
+    """Mảng hình học EPSG:4326 → tọa độ mét trên phép chiếu đồng diện tích (vector hóa)"""
+    transformer = _equal_area_transformer()
+    return shapely.transform(
+        np.asarray(geoms, dtype=object),
+        lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])),
+    )
+
+
+# =====================
+# 🗂️ CHỈ MỤC KHÔNG GIAN CHO LỚP XÃ
+# =====================
+class CommuneIndex:
+    """Chỉ mục STRtree dựng một lần trên lớp xã, dùng cho bước [Lấy xã]"""
+
+    def __init__(self, gdf):
+        self.gdf = gdf
+        self.geoms = np.asarray(gdf.geometry.values, dtype=object)
+        # Prepare sẵn hình học các xã → predicate nhanh hơn ở mỗi lần gọi
+        shapely.prepare(self.geoms)
+        self.tree = STRtree(self.geoms)
+        self._geoms_ea = None
+        self._areas_ea = None
+
+    def query(self, polygons):
+        """Trả về chỉ số (đã sắp xếp) các xã giao với ít nhất 1 polygon đã vẽ"""
+        polys = np.asarray(list(polygons), dtype=object)
+        if len(polys) == 0:
+            return np.empty(0, dtype=np.intp)
+
+        # Bước 1: lọc thô theo bbox qua STRtree (không cần unary_union)
+        poly_idx, xa_idx = self.tree.query(polys)
+        if len(xa_idx) == 0:
+            return np.empty(0, dtype=np.intp)
+
+        # Bước 2: kiểm tra chính xác trên hình học xã đã prepare
+        hits = shapely.intersects(self.geoms[xa_idx], polys[poly_idx])
+        return np.unique(xa_idx[hits])
+
+    def query_each(self, polygons):
+        """Như query nhưng tách theo từng polygon → list mảng chỉ số xã (1 mảng / polygon)"""
+        polys = np.asarray(list(polygons), dtype=object)
+        if len(polys) == 0:
+            return []
+        poly_idx, xa_idx = self.tree.query(polys)
+        hits = shapely.intersects(self.geoms[xa_idx], polys[poly_idx])
+        poly_idx, xa_idx = poly_idx[hits], xa_idx[hits]
+        return [np.unique(xa_idx[poly_idx == i]) for i in range(len(polys))]
+
+    def select(self, polygons):
+        """Trả về GeoDataFrame các xã giao với các vùng đã vẽ (giữ thứ tự gốc)"""
+        return self.gdf.iloc[self.query(polygons)]
+
+    def locate(self, lon, lat):
+        """Vị trí (iloc) xã chứa từng điểm lon/lat → mảng chỉ số, NO_COMMUNE nếu ngoài lớp xã
+
+        Vector hóa hoàn toàn: STRtree lọc cặp (điểm, xã) theo bbox, kiểm tra chính xác
+        trên hình học xã đã prepare; điểm nằm đúng ranh giới 2 xã → lấy xã có chỉ số nhỏ hơn.
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        located = np.full(len(lon), NO_COMMUNE, dtype=np.intp)
+        valid = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        if len(valid) == 0:
+            return located
+
+        points = shapely.points(lon[valid], lat[valid])
+        pt_idx, xa_idx = self.tree.query(points)
+        hits = shapely.intersects(self.geoms[xa_idx], points[pt_idx])
+        pt_idx, xa_idx = pt_idx[hits], xa_idx[hits]
+
+        order = np.lexsort((xa_idx, pt_idx))
+        pt_idx, xa_idx = pt_idx[order], xa_idx[order]
+        first = np.unique(pt_idx, return_index=True)[1]
+        located[valid[pt_idx[first]]] = xa_idx[first]
+        return located
+
+    def select_points(self, lon, lat):
+        """(GeoDataFrame các xã có ít nhất 1 điểm kèm cột points, vị trí xã của từng điểm)"""
+        located = self.locate(lon, lat)
+        counts = np.bincount(located[located != NO_COMMUNE], minlength=len(self.geoms))
+        idx = np.flatnonzero(counts)
+        selected_gdf = self.gdf.iloc[idx].copy()
+        selected_gdf["points"] = counts[idx]
+        return selected_gdf, located
+
+    def attributes_at(self, located, fields=("Xa", "Diem")):
+        """Thuộc tính xã theo kết quả locate() → DataFrame 1 dòng / điểm (NaN nếu ngoài lớp xã)"""
+        return self.gdf[list(fields)].reset_index(drop=True).reindex(np.asarray(located)).reset_index(drop=True)
+
+    def _equal_area(self):
+        # Chiếu lớp xã + tính diện tích 1 lần (chỉ khi dùng tới tỉ lệ diện tích)
+        if self._geoms_ea is None:
+            self._geoms_ea = to_equal_area(self.geoms)
+            self._areas_ea = shapely.area(self._geoms_ea)
+        return self._geoms_ea, self._areas_ea
+
+    def coverage_pairs(self, polygons):
+        """Các cặp (vùng, xã) có phần trong giao nhau + tỉ lệ diện tích xã nằm trong từng vùng
+
+        Trả về (chỉ số vùng, chỉ số xã, tỉ lệ). Xã chỉ chạm cạnh vùng bị loại ngay bằng
+        predicate (giao nhưng không chỉ chạm ⇔ phần trong giao nhau, đúng cả với hợp các vùng).
+        Xã không bị cạnh vùng cắt qua nằm trọn trong vùng (tỉ lệ 1); chỉ các cặp bị cắt mới
+        tính phép giao trên phép chiếu đồng diện tích — tất cả theo mảng shapely.
+        """
+        polys = np.asarray(list(polygons), dtype=object)
+        if len(polys) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+
+        poly_idx, xa_idx = self.tree.query(polys)
+        xa_geoms, pair_polys = self.geoms[xa_idx], polys[poly_idx]
+        hits = shapely.intersects(xa_geoms, pair_polys) & ~shapely.touches(xa_geoms, pair_polys)
+        poly_idx, xa_idx = poly_idx[hits], xa_idx[hits]
+        fractions = np.ones(len(xa_idx))
+        if len(xa_idx) == 0:
+            return poly_idx, xa_idx, fractions
+
+        crossing = shapely.intersects(self.geoms[xa_idx], shapely.boundary(polys[poly_idx]))
+        if crossing.any():
+            # Giao trên hình chiếu, vùng vẽ được cắt sẵn theo bbox của xã
+            geoms_ea, areas_ea = self._equal_area()
+            polys_ea = to_equal_area(polys)
+            pair_xa = xa_idx[crossing]
+            boxes = shapely.box(*shapely.bounds(geoms_ea[pair_xa]).T)
+            clipped = shapely.intersection(polys_ea[poly_idx[crossing]], boxes)
+            pieces = shapely.intersection(geoms_ea[pair_xa], clipped)
+            fractions[crossing] = shapely.area(pieces) / areas_ea[pair_xa]
+        return poly_idx, xa_idx, np.clip(fractions, 0.0, 1.0)
+
+    def union_fraction(self, commune, polygons):
+        """Tỉ lệ diện tích 1 xã nằm trong hợp nhiều vùng (các vùng có thể chồng nhau)"""
+        geoms_ea, areas_ea = self._equal_area()
+        box = shapely.box(*shapely.bounds(geoms_ea[commune]))
+        drawn = shapely.union_all(shapely.intersection(to_equal_area(list(polygons)), box))
+        covered = shapely.area(shapely.intersection(geoms_ea[commune], drawn))
+        return float(np.clip(covered / areas_ea[commune], 0.0, 1.0))
+
+    def coverage(self, polygons):
+        """Tỉ lệ diện tích (0..1) của từng xã nằm trong hợp các vùng đã vẽ
+
+        Trả về (chỉ số xã có phần trong giao với vùng vẽ, tỉ lệ).
+        """
+        polys = np.asarray(list(polygons), dtype=object)
+        poly_idx, xa_idx, pair_fractions = self.coverage_pairs(polys)
+        return combine_coverage(
+            xa_idx, pair_fractions,
+            lambda commune, pairs: self.union_fraction(commune, polys[poly_idx[pairs]]),
+        )
+
+
+    def select_covered(self, polygons, min_fraction=0.0):
+        """GeoDataFrame các xã có tỉ lệ diện tích trong vùng vẽ ≥ min_fraction, kèm cột coverage
+
+        Xã chỉ chạm cạnh vùng vẽ (tỉ lệ ≈ 0) luôn bị loại.
+        """
+        idx, fractions = self.coverage(polygons)
+        keep = (fractions > COVERAGE_EPSILON) & (fractions >= min_fraction)
+        selected_gdf = self.gdf.iloc[idx[keep]].copy()
+        selected_gdf["coverage"] = fractions[keep]
+        return selected_gdf
+
+
+def combine_coverage(xa_idx, pair_fractions, union_fraction):
+    """Gộp tỉ lệ theo từng cặp (vùng, xã) → (chỉ số xã, tỉ lệ trong hợp các vùng)
+
+    Xã chỉ thuộc 1 vùng hoặc nằm trọn trong 1 vùng → lấy thẳng tỉ lệ của cặp; xã bị
+    nhiều vùng cắt qua → union_fraction(xã, vị trí các cặp của xã) tính trên hợp các vùng.
+    """
+    communes, inverse = np.unique(xa_idx, return_inverse=True)
+    fractions = np.zeros(len(communes))
+    np.maximum.at(fractions, inverse, pair_fractions)
+    counts = np.bincount(inverse, minlength=len(communes))
+    for c in np.flatnonzero((counts > 1) & (fractions < 1.0)):
+        fractions[c] = union_fraction(communes[c], np.flatnonzero(inverse == c))
+    return communes, fractions
+
+
+# =====================
+# 📋 GOM XÃ THEO HUYỆN
+# =====================
+def group_by_district(selected_gdf, with_coverage=False, with_points=False):
+    """Gom danh sách xã theo cột Diem → DataFrame (Diem, Xa)
+
+    with_coverage=True (và có cột coverage): ghi kèm % diện tích, vd. "Tri Lễ (35%)".
+    with_points=True (và có cột points): ghi kèm số điểm, vd. "Tri Lễ (12 điểm)".
+    """
+    if with_coverage and "coverage" in selected_gdf:
+        percent = (selected_gdf["coverage"] * 100).round().astype(int).astype(str)
+        percent = percent.where(selected_gdf["coverage"] >= 0.005, "<1")
+        selected_gdf = selected_gdf.assign(Xa=selected_gdf["Xa"] + " (" + percent + "%)")
+    if with_points and "points" in selected_gdf:
+        selected_gdf = selected_gdf.assign(
+            Xa=selected_gdf["Xa"] + " (" + selected_gdf["points"].astype(str) + " điểm)"
+        )
+    return (
+        selected_gdf.groupby("Diem")["Xa"]
+        .apply(lambda x: ", ".join(sorted(set(x))))
+        .reset_index()
+    )
+
+
+def count_points_by_district(selected_gdf):
+    """Số điểm + số xã theo huyện từ kết quả CommuneIndex.select_points → DataFrame"""
+    return (
+        selected_gdf.groupby("Diem")
+        .agg(so_xa=("Xa", "size"), so_diem=("points", "sum"))
+        .reset_index()
+        .sort_values("so_diem", ascending=False, ignore_index=True)
+    )
+
+
+# =====================
+# 🧠 GHI NHỚ KẾT QUẢ CHỌN XÃ THEO VÙNG ĐÃ VẼ
+# =====================
+def geometry_key(geom):
+    """Hash WKB của hình đã chuẩn hóa → cùng 1 vùng (dù thứ tự đỉnh khác) luôn cùng khóa"""
+    return hashlib.sha1(shapely.to_wkb(shapely.normalize(geom))).hexdigest()
+
+
+class SelectionMemo:
+    """Ghi nhớ kết quả [Lấy xã] theo tập vùng đã vẽ, cập nhật tăng dần khi thêm/xóa vùng
+
+    Mỗi vùng chỉ được giao với lớp xã 1 lần; thêm/xóa 1 vùng chỉ cộng/trừ các xã
+    của vùng đó vào bộ đếm chung, không tính lại các vùng còn lại. Tỉ lệ diện tích
+    cũng tăng dần: cặp (vùng, xã) tính 1 lần / vùng, chỉ xã bị nhiều vùng cắt qua và
+    chạm vùng vừa thêm/xóa mới tính lại trên hợp các vùng.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._hits = {}  # khóa vùng → chỉ số các xã giao với vùng đó
+        self._polygons = {}  # khóa vùng → WKB hình học (cho tỉ lệ diện tích)
+        self._counts = np.zeros(len(index.geoms), dtype=np.int32)  # số vùng chạm mỗi xã
+        self._pairs = {}  # khóa vùng → (xã có phần trong giao vùng, tỉ lệ xã trong vùng) — tính khi cần
+        self._union = {}  # xã bị nhiều vùng cắt → tỉ lệ trong hợp các vùng (bỏ khi vùng liên quan đổi)
+        self._result_key = None
+        self._result = None
+
+    def update(self, polygons):
+        """Đồng bộ với danh sách vùng hiện tại → khóa của cả tập vùng"""
+        polygons_by_key = {geometry_key(p): p for p in polygons}
+
+        for key in self._hits.keys() - polygons_by_key.keys():
+            hits = self._hits.pop(key)
+            self._counts[hits] -= 1
+            del self._polygons[key]
+            self._pairs.pop(key, None)
+            self._forget_unions(hits)
+
+        added = [key for key in polygons_by_key if key not in self._hits]
+        for key, hits in zip(added, self.index.query_each(polygons_by_key[k] for k in added)):
+            self._hits[key] = hits
+            self._polygons[key] = shapely.to_wkb(polygons_by_key[key])
+            self._counts[hits] += 1
+            self._forget_unions(hits)
+
+        return frozenset(polygons_by_key)
+
+    def _forget_unions(self, communes):
+        for commune in communes:
+            self._union.pop(commune, None)
+
+    def coverage(self):
+        """(chỉ số xã, tỉ lệ diện tích trong hợp các vùng hiện tại) — chỉ tính phần đã đổi"""
+        missing = [key for key in self._hits if key not in self._pairs]
+        if missing:
+            poly_idx, xa_idx, fractions = self.index.coverage_pairs(
+                polygons_from_wkb([self._polygons[key] for key in missing])
+            )
+            for i, key in enumerate(missing):
+                mine = poly_idx == i
+                self._pairs[key] = (xa_idx[mine], fractions[mine])
+
+        keys = list(self._hits)
+        if not keys:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        xa_idx = np.concatenate([self._pairs[key][0] for key in keys])
+        pair_fractions = np.concatenate([self._pairs[key][1] for key in keys])
+        owner = np.repeat(np.arange(len(keys)), [len(self._pairs[key][0]) for key in keys])
+
+        def union_fraction(commune, pairs):
+            if commune not in self._union:
+                polygons = polygons_from_wkb([self._polygons[keys[i]] for i in owner[pairs]])
+                self._union[commune] = self.index.union_fraction(commune, polygons)
+            return self._union[commune]
+
+        return combine_coverage(xa_idx, pair_fractions, union_fraction)
+
+    def select(self, polygons, min_fraction=None, with_coverage=False):
+        """(GeoDataFrame xã, DataFrame gom theo huyện) — chỉ tính lại khi tập vùng/tùy chọn đổi
+
+        min_fraction=None: mọi xã giao với vùng vẽ; ngược lại lọc theo tỉ lệ diện tích.
+        """
+        key = (self.update(polygons), min_fraction, with_coverage)
+        if key != self._result_key:
+            if min_fraction is None:
+                idx, fractions = np.flatnonzero(self._counts), None
+            else:
+                communes, fractions = self.coverage()
+                keep = (fractions > COVERAGE_EPSILON) & (fractions >= min_fraction)
+                idx, fractions = communes[keep], fractions[keep]
+            grouped_df = group_by_district(self._rows(idx, fractions), with_coverage)
+            self._result = (idx, fractions, grouped_df)
+            self._result_key = key
+        idx, fractions, grouped_df = self._result
+        return self._rows(idx, fractions), grouped_df
+
+    def _rows(self, idx, fractions):
+        """Dựng lại các dòng xã từ lớp xã dùng chung — memo chỉ giữ chỉ số + tỉ lệ"""
+        rows = self.index.gdf.iloc[idx]
+        return rows if fractions is None else rows.assign(coverage=fractions)
+
+
+# =====================
+# 🪶 HÌNH HỌC RÚT GỌN NHIỀU MỨC CHO LỚP HIỂN THỊ
+# =====================
+# (zoom tối đa, tolerance theo độ, số chữ số thập phân giữ lại)
+# ~1 pixel màn hình ở mức zoom tương ứng; zoom lớn hơn mức cuối → dùng hình học gốc
+DISPLAY_LEVELS = [
+    (7, 0.01, 3),
+    (9, 0.0025, 4),
+    (11, 0.0006, 4),
+    (13, 0.00015, 5),
+]
+FULL_PRECISION_DIGITS = 6
+DISPLAY_FIELDS = ["Xa", "Diem"]
+
+
+def _to_feature_collection(geoms, gdf, digits):
+    """Ghép hình học + thuộc tính tooltip thành GeoJSON, lượng tử hóa tọa độ"""
+    # Làm tròn theo cùng 1 lưới → đỉnh chung giữa 2 xã vẫn trùng nhau
+    geoms = shapely.transform(geoms, lambda coords: np.round(coords, digits))
+    props = gdf[DISPLAY_FIELDS].to_dict("records")
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": p, "geometry": g.__geo_interface__}
+            for p, g in zip(props, geoms)
+        ],
+    }
+
+
+def simplify_display_geometries(gdf, levels=DISPLAY_LEVELS):
+    """Rút gọn (giữ topo) lớp xã theo từng mức → [(zoom tối đa, geoms, số chữ số)]
+
+    Dùng coverage_simplify → cạnh chung giữa các xã được rút gọn đúng 1 lần,
+    không sinh khe hở/chồng lấn giữa các xã lân cận.
+    Chỉ dùng để hiển thị — bước [Lấy xã] vẫn dùng hình học gốc.
+    """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    result = [
+        (max_zoom, shapely.coverage_simplify(geoms, tolerance), digits)
+        for max_zoom, tolerance, digits in levels
+    ]
+    result.append((None, geoms, FULL_PRECISION_DIGITS))
+    return result
+
+
+def display_level_for_zoom(zoom, levels=DISPLAY_LEVELS):
+    """Mức rút gọn phù hợp với mức zoom → (zoom tối đa, tolerance, số chữ số); None = hình học gốc"""
+    for level in levels:
+        if zoom <= level[0]:
+            return level
+    return None
+
+
+def build_display_layer(gdf, level):
+    """GeoJSON của lớp xã ở 1 mức rút gọn (level từ display_level_for_zoom) cho folium.GeoJson
+
+    Chỉ tính đúng mức được yêu cầu — nơi gọi tự cache theo level.
+    """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    if level is None:
+        return _to_feature_collection(geoms, gdf, FULL_PRECISION_DIGITS)
+    _max_zoom, tolerance, digits = level
+    return _to_feature_collection(shapely.coverage_simplify(geoms, tolerance), gdf, digits)
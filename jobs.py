@@ -0,0 +1,108 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# =====================
+# ⚙️ CẤU HÌNH HÀNG ĐỢI VIỆC CHẠY NỀN
+# =====================
+JOB_WORKERS = 4
+JOB_KEEP_SECONDS = 600     # việc đã xong được giữ lại để session đọc kết quả
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """1 việc chạy nền: trạng thái, tiến độ (0..1), thông báo và kết quả/lỗi"""
+
+    def __init__(self, key, label):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.label = label
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "Đang chờ..."
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.created_at
+
+    def update(self, progress=None, message=None):
+        """Gọi từ bên trong việc để báo tiến độ"""
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+
+
+# =====================
+# 🧵 BỘ CHẠY VIỆC NỀN DÙNG CHUNG (gộp các việc trùng đang chạy)
+# =====================
+class JobExecutor:
+    """Chạy việc chậm (chụp radar, xuất Excel) ngoài luồng script Streamlit
+
+    Việc có cùng `key` đang chờ/đang chạy được gộp làm 1 (bấm đúp, nhiều session
+    cùng yêu cầu); session chỉ giữ job id trong st.session_state và hỏi trạng thái.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, keep_seconds=JOB_KEEP_SECONDS):
+        self.keep_seconds = keep_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._active_by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, label, fn, *args, **kwargs):
+        """Chạy fn(job, *args, **kwargs) ở luồng nền → Job (việc cũ nếu cùng key đang chạy)"""
+        with self._lock:
+            self._purge()
+            job = self._active_by_key.get(key)
+            if job is not None and job.active:
+                return job
+            job = Job(key, label)
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        job.message = "Đang xử lý..."
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.message = "Xong"
+            job.status = DONE
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}\n\n{traceback.format_exc()}"
+            job.message = "Lỗi"
+            job.status = FAILED
+        finally:
+            job.finished_at = time.monotonic()
+            with self._lock:
+                if self._active_by_key.get(job.key) is job:
+                    del self._active_by_key[job.key]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge(self):
+        now = time.monotonic()
+        for job_id in [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.keep_seconds
+        ]:
+            del self._jobs[job_id]
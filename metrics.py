@@ -0,0 +1,133 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# =====================
+# ⚙️ CẤU HÌNH ĐO HIỆU NĂNG
+# =====================
+MAX_SAMPLES = 500                  # số lần đo gần nhất giữ lại cho mỗi bước
+PERCENTILES = (50, 90, 99)
+# Streamlit phục vụ ./static tại /app/static → /app/static/metrics.json
+METRICS_SUMMARY_PATH = os.path.join("static", "metrics.json")
+SUMMARY_INTERVAL = 10              # giây — chu kỳ ghi lại file tổng hợp
+# Đặt biến môi trường này = đường dẫn file → ghi mỗi lần đo thành 1 dòng JSON
+METRICS_LOG_ENV = "XA_NA_METRICS_LOG"
+
+
+def _rss_mb():
+    """Bộ nhớ RSS hiện tại của process (MB), None nếu không đọc được"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    # Không có /proc (macOS) → dùng đỉnh RSS thay cho RSS hiện tại
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if os.uname().sysname == "Darwin" else peak / 2**10
+
+
+# =====================
+# ⏱️ BỘ ĐO THỜI GIAN / BỘ NHỚ THEO BƯỚC (dùng chung mọi session trong process)
+# =====================
+class StageMetrics:
+    """Ghi thời gian + chênh lệch RSS của từng bước, tính percentile trên các lần đo gần nhất"""
+
+    def __init__(self, max_samples=MAX_SAMPLES, summary_path=METRICS_SUMMARY_PATH,
+                 log_path=None):
+        self.max_samples = max_samples
+        self.summary_path = summary_path
+        self.log_path = log_path or os.environ.get(METRICS_LOG_ENV)
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._last_summary = 0.0
+
+    def record(self, stage, ms, rss_delta=None, rss=None):
+        sample = {"ts": round(time.time(), 3), "stage": stage, "ms": round(ms, 2)}
+        if rss is not None:
+            sample["rss_mb"] = round(rss, 1)
+            sample["rss_delta_mb"] = round(rss_delta, 1)
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.max_samples)).append(sample)
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(sample) + "\n")
+                except OSError:
+                    pass  # đo hiệu năng không bao giờ được làm hỏng bước đang đo
+            write_summary = time.monotonic() - self._last_summary > SUMMARY_INTERVAL
+            if write_summary:
+                self._last_summary = time.monotonic()
+        if write_summary and self.summary_path:
+            self.write_summary()
+
+    @contextmanager
+    def timed(self, stage):
+        """with timed("excel.save"): ... → ghi lại thời gian (ms) và chênh lệch RSS"""
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            rss = _rss_mb()
+            rss_delta = rss - rss_before if rss is not None and rss_before is not None else None
+            self.record(stage, ms, rss_delta, rss if rss_delta is not None else None)
+
+    def summary(self):
+        """Thống kê theo bước: số lần đo, p50/p90/p99, max, lần cuối (ms), RSS cuối (MB)"""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+        rows = []
+        for stage in sorted(samples):
+            ms = np.array([s["ms"] for s in samples[stage]])
+            row = {"stage": stage, "count": len(ms)}
+            for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+                row[f"p{p}_ms"] = round(float(value), 1)
+            row["max_ms"] = round(float(ms.max()), 1)
+            row["last_ms"] = samples[stage][-1]["ms"]
+            row["rss_mb"] = samples[stage][-1].get("rss_mb")
+            rows.append(row)
+        return rows
+
+    def write_summary(self, path=None):
+        """Ghi tổng hợp ra JSON (mặc định static/metrics.json → /app/static/metrics.json)
+
+        Mỗi lần ghi dùng file tạm riêng (nhiều luồng ghi cùng lúc không đụng nhau);
+        không ghi được (thư mục chỉ đọc...) → trả về False thay vì raise.
+        """
+        path = path or self.summary_path
+        data = {"generated_at": round(time.time(), 3), "stages": self.summary()}
+        tmp_path = None
+        try:
+            directory = os.path.dirname(path) or "."
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp_path, path)
+            return True
+        except OSError:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return False
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+METRICS = StageMetrics()
+timed = METRICS.timed
@@ -0,0 +1,288 @@
+import glob
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import timed
+
+# =====================
+# ⚙️ CẤU HÌNH NGUỒN RADAR
+# =====================
+RADAR_BASE_URL = "http://hymetnet.gov.vn/dataout_web/VIN"
+RADAR_FRAME_MINUTES = 10
+RADAR_HISTORY_FRAMES = 6       # số khung 10 phút mặc định (≈ 1 giờ)
+
+# Vùng phủ của ảnh CMAX trạm VIN (ô vuông ±radius quanh tâm radar)
+RADAR_CENTER_LAT = 18.656
+RADAR_CENTER_LON = 105.71083
+RADAR_RADIUS_DEG = 2.8
+
+FETCH_TIMEOUT = (3, 10)        # (connect, read) giây
+FETCH_WORKERS = 8
+CACHE_MAX_FRAMES = 64
+CACHE_MAX_BYTES = 128 * 1024 * 1024   # tổng dung lượng PNG gốc + các biến thể (lưới dBZ, lớp phủ)
+CACHE_TTL = 6 * 3600           # khung đã phát hành không đổi → giữ lâu
+CACHE_MISS_TTL = 60            # khung chưa có (404/timeout) → thử lại sau 1 phút
+
+# Khung radar phục vụ dạng file tĩnh (Streamlit phục vụ ./static tại /app/static)
+RADAR_STATIC_DIR = os.path.join("static", "radar")
+RADAR_STATIC_URL = "/app/static/radar/{filename}"
+RADAR_STATIC_MAX_FILES = CACHE_MAX_FRAMES
+
+PREFETCH_INTERVAL = 30         # giây — chu kỳ kiểm tra khung 10 phút mới phát hành
+
+
+# =====================
+# 🛰️ HÀM LẤY URL ẢNH RADAR
+# =====================
+def get_vin_radar_urls(n=2, now=None):
+    """Lấy URL của n ảnh radar mới nhất từ trạm VIN (cũ → mới)"""
+    now = now or datetime.now(timezone.utc)
+    latest = now - timedelta(minutes=RADAR_FRAME_MINUTES)
+    latest = latest.replace(
+        minute=(latest.minute // RADAR_FRAME_MINUTES) * RADAR_FRAME_MINUTES,
+        second=0, microsecond=0,
+    )
+
+    urls = []
+    for i in reversed(range(n)):
+        dt = latest - timedelta(minutes=RADAR_FRAME_MINUTES * i)
+        ymd = dt.strftime("%Y%m%d")
+        ymdhm = dt.strftime("%Y%m%d%H%M")
+        display_time = (dt + timedelta(hours=7)).strftime("%H:%M")
+        urls.append((ymdhm, f"{RADAR_BASE_URL}/{ymd}/VIN_{ymdhm}_CMAX00.png", display_time, dt))
+    return urls
+
+
+def radar_bounds():
+    """Bounds [[lat_min, lon_min], [lat_max, lon_max]] của ảnh radar VIN"""
+    return [
+        [RADAR_CENTER_LAT - RADAR_RADIUS_DEG, RADAR_CENTER_LON - RADAR_RADIUS_DEG],
+        [RADAR_CENTER_LAT + RADAR_RADIUS_DEG, RADAR_CENTER_LON + RADAR_RADIUS_DEG],
+    ]
+
+
+# =====================
+# 🗃️ CACHE TTL/LRU THEO ymdhm
+# =====================
+def _nbytes(value):
+    """Dung lượng ước tính của 1 giá trị trong cache (bytes/str/mảng numpy/tuple)"""
+    if value is None:
+        return 0
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return getattr(value, "nbytes", 0)
+
+
+class FrameCache:
+    """Cache LRU có TTL, giới hạn theo số mục và tổng dung lượng, an toàn đa luồng"""
+
+    def __init__(self, max_items=CACHE_MAX_FRAMES, ttl=CACHE_TTL, miss_ttl=CACHE_MISS_TTL,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Trả về (có trong cache?, giá trị) — giá trị None nghĩa là khung chưa có"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return False, None
+            expires, value, size = item
+            if expires < time.monotonic():
+                del self._items[key]
+                self.total_bytes -= size
+                return False, None
+            self._items.move_to_end(key)
+            return True, value
+
+    def put(self, key, value):
+        ttl = self.ttl if value is not None else self.miss_ttl
+        size = _nbytes(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            self._items[key] = (time.monotonic() + ttl, value, size)
+            self.total_bytes += size
+            # Bỏ mục dùng lâu nhất cho tới khi vừa giới hạn (luôn giữ mục vừa thêm)
+            while len(self._items) > 1 and (
+                len(self._items) > self.max_items or self.total_bytes > self.max_bytes
+            ):
+                _, (_, _, evicted) = self._items.popitem(last=False)
+                self.total_bytes -= evicted
+
+
+# =====================
+# 🌧️ TẢI SONG SONG CÁC KHUNG RADAR
+# =====================
+class RadarFetcher:
+    """Tải khung radar song song qua 1 connection pool chung, có cache theo ymdhm"""
+
+    def __init__(self, workers=FETCH_WORKERS, cache=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="radar-fetch")
+        self.cache = cache or FrameCache()
+        self._inflight = {}
+        self._inflight_lock = threading.RLock()
+        self._latest_dt = None
+        self._prefetch_thread = None
+
+    def download_bytes(self, url):
+        """Tải 1 ảnh radar → bytes PNG (None nếu lỗi hoặc chưa phát hành)"""
+        try:
+            r = self.session.get(url, timeout=FETCH_TIMEOUT)
+            if r.status_code == 200:
+                return r.content
+            return None
+        except requests.RequestException:
+            return None
+
+    def _fetch_frame(self, timecode, url, retry_miss=False):
+        found, value = self.cache.get(timecode)
+        if found and (value is not None or not retry_miss):
+            return value
+        with timed("radar.download"):
+            content = self.download_bytes(url)
+        # Chỉ giữ bytes PNG gốc — lớp phủ bản đồ dùng biến thể "overlay" đã crop
+        value = content or None
+        self.cache.put(timecode, value)
+        return value
+
+    def _submit(self, timecode, url, retry_miss=False):
+        """Gộp các yêu cầu trùng timecode đang tải dở (nhiều session cùng lúc)"""
+        with self._inflight_lock:
+            future = self._inflight.get(timecode)
+            if future is None:
+                future = self.executor.submit(self._fetch_frame, timecode, url, retry_miss)
+                self._inflight[timecode] = future
+                future.add_done_callback(lambda _f: self._forget(timecode))
+            return future
+
+    def _forget(self, timecode):
+        with self._inflight_lock:
+            self._inflight.pop(timecode, None)
+
+    def load_frames(self, n=RADAR_HISTORY_FRAMES, now=None):
+        """Tải n khung mới nhất song song → [(timecode, display_time)] các khung đã có"""
+        now = now or datetime.now(timezone.utc)
+        if self._latest_dt is not None:
+            # Luồng nền đã thấy khung mới phát hành → tính cửa sổ tới đúng khung đó
+            now = max(now, self._latest_dt + timedelta(minutes=RADAR_FRAME_MINUTES))
+        with timed("radar.urls"):
+            urls = get_vin_radar_urls(n, now)
+        with timed("radar.load_frames"):
+            futures = [
+                (timecode, display_time, dt, self._submit(timecode, url))
+                for timecode, url, display_time, dt in urls
+            ]
+            loaded_radars = []
+            for timecode, display_time, dt, future in futures:
+                if future.result():
+                    loaded_radars.append((timecode, display_time))
+        return loaded_radars
+
+    def frame_bytes(self, timecode):
+        """Bytes PNG gốc của 1 khung đã tải (None nếu chưa có trong cache)"""
+        found, content = self.cache.get(timecode)
+        return content if found else None
+
+    def frame_url(self, timecode, static_dir=RADAR_STATIC_DIR, kind=None, content=None):
+        """Ghi khung ra thư mục static (1 lần) → URL tĩnh để trình duyệt tự tải và cache
+
+        Khung đã phát hành không đổi nên tên file theo timecode (+ loại biến thể) là đủ;
+        `content()` trả về bytes của biến thể `kind` (mặc định: PNG gốc). None nếu chưa tải.
+        """
+        filename = f"VIN_{timecode}_{kind}.png" if kind else f"VIN_{timecode}.png"
+        path = os.path.join(static_dir, filename)
+        if not os.path.exists(path):
+            content = content() if content else self.frame_bytes(timecode)
+            if content is None:
+                return None
+            os.makedirs(static_dir, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+            # Chỉ giữ các khung mới nhất (tên file chứa ymdhm → sắp xếp theo thời gian)
+            files = sorted(glob.glob(os.path.join(static_dir, "VIN_*.png")))
+            for old in files[:-RADAR_STATIC_MAX_FILES]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        return RADAR_STATIC_URL.format(filename=filename)
+
+    def frame_variant(self, timecode, kind, build):
+        """Biến thể dẫn xuất của 1 khung (vd. lưới dBZ đã giải mã), tính 1 lần và cache chung
+
+        `build(png_bytes)` chỉ chạy khi cache chưa có; None nếu khung chưa tải.
+        """
+        key = (timecode, kind)
+        found, value = self.cache.get(key)
+        if found:
+            return value
+        content = self.frame_bytes(timecode)
+        if content is None:
+            return None
+        value = build(content)
+        self.cache.put(key, value)
+        return value
+
+    # =====================
+    # ⏱️ LUỒNG NỀN: LẤY KHUNG MỚI NGAY KHI PHÁT HÀNH
+    # =====================
+    def prefetch_once(self, n=RADAR_HISTORY_FRAMES, variants=None, now=None):
+        """Thử tải khung của ô 10 phút hiện tại + n khung gần nhất, tính sẵn các biến thể"""
+        now = now or datetime.now(timezone.utc)
+        # Khung có thể vừa phát hành (sớm hơn độ trễ 10 phút mà get_vin_radar_urls giả định)
+        timecode, url, _display_time, dt = get_vin_radar_urls(
+            1, now + timedelta(minutes=RADAR_FRAME_MINUTES)
+        )[0]
+        if self._submit(timecode, url, retry_miss=True).result():
+            if self._latest_dt is None or dt > self._latest_dt:
+                self._latest_dt = dt
+
+        frames = self.load_frames(n, now)
+        if frames:
+            for kind, build in (variants or {}).items():
+                self.frame_variant(frames[-1][0], kind, build)
+        return frames
+
+    def _prefetch_loop(self, n, variants, interval):
+        while True:
+            try:
+                self.prefetch_once(n, variants)
+            except Exception:
+                pass  # lỗi mạng/giải mã → thử lại ở chu kỳ sau
+            time.sleep(interval)
+
+    def start_prefetch(self, n=RADAR_HISTORY_FRAMES, variants=None, interval=PREFETCH_INTERVAL):
+        """Chạy 1 luồng nền duy nhất cho fetcher này — các session chỉ đọc cache"""
+        with self._inflight_lock:
+            if self._prefetch_thread is None:
+                self._prefetch_thread = threading.Thread(
+                    target=self._prefetch_loop,
+                    args=(n, variants, interval),
+                    name="radar-prefetch",
+                    daemon=True,
+                )
+                self._prefetch_thread.start()
+        return self._prefetch_thread
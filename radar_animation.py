@@ -0,0 +1,105 @@
+import folium
+from branca.element import MacroElement
+from jinja2 import Template
+
+from radar import radar_bounds
+
+# =====================
+# ⚙️ CẤU HÌNH HOẠT ẢNH RADAR
+# =====================
+FRAME_INTERVAL_MS = 700     # thời gian hiển thị mỗi khung khi chạy
+LOOP_PAUSE_MS = 1500        # dừng thêm ở khung mới nhất trước khi quay lại từ đầu
+
+
+# =====================
+# 🎞️ VÒNG LẶP KHUNG RADAR CHẠY TRÊN TRÌNH DUYỆT
+# =====================
+class RadarAnimation(MacroElement):
+    """Các khung radar (URL tĩnh) + nút ⏮ ▶ ⏭ — chuyển khung hoàn toàn phía trình duyệt
+
+    Mọi khung được thêm sẵn vào feature group cha (opacity 0) để trình duyệt tải trước;
+    chuyển khung chỉ đổi opacity, không cần rerun Streamlit.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var group = {{ this._parent.get_name() }};
+            var frames = {{ this.frames|tojson }};
+            var bounds = {{ this.bounds|tojson }};
+            var opacity = {{ this.opacity }};
+            var n = frames.length, idx = n - 1, timer = null;
+
+            var overlays = frames.map(function(f) {
+                return L.imageOverlay(f[0], bounds, {opacity: 0, interactive: false, zIndex: 1}).addTo(group);
+            });
+
+            var control = L.control({position: 'bottomright'});
+            var label, playBtn;
+            control.onAdd = function() {
+                var div = L.DomUtil.create('div', 'leaflet-bar');
+                div.style.cssText = 'background:#fff;padding:4px 6px;font:13px sans-serif;' +
+                                    'display:flex;align-items:center;gap:4px';
+                function button(text, title, onClick) {
+                    var b = L.DomUtil.create('a', '', div);
+                    b.href = '#'; b.innerHTML = text; b.title = title;
+                    b.style.cssText = 'position:static;width:26px;height:26px;line-height:26px';
+                    L.DomEvent.on(b, 'click', function(e) { L.DomEvent.preventDefault(e); onClick(); });
+                    return b;
+                }
+                button('&#9198;', 'Khung trước', function() { stop(); show(idx - 1); });
+                playBtn = button('&#9654;', 'Chạy / dừng', function() { timer ? stop() : play(); });
+                button('&#9197;', 'Khung sau', function() { stop(); show(idx + 1); });
+                label = L.DomUtil.create('span', '', div);
+                label.style.cssText = 'min-width:80px;text-align:center;font-weight:bold';
+                L.DomEvent.disableClickPropagation(div);
+                L.DomEvent.disableScrollPropagation(div);
+                show(idx);
+                return div;
+            };
+
+            function show(i) {
+                overlays[idx].setOpacity(0);
+                idx = (i + n) % n;
+                overlays[idx].setOpacity(opacity);
+                if (label) label.innerHTML = '&#128337; ' + frames[idx][1] + ' (' + (idx + 1) + '/' + n + ')';
+            }
+            function tick() {
+                show(idx + 1);
+                timer = setTimeout(tick, idx === n - 1 ? {{ this.interval }} + {{ this.loop_pause }} : {{ this.interval }});
+            }
+            function play() {
+                if (playBtn) playBtn.innerHTML = '&#9208;';
+                timer = setTimeout(tick, {{ this.interval }});
+            }
+            function stop() {
+                if (timer) clearTimeout(timer);
+                timer = null;
+                if (playBtn) playBtn.innerHTML = '&#9654;';
+            }
+
+            show(idx);
+            if (group._map) control.addTo(group._map);
+            group.on('add', function(e) { control.addTo(e.target._map); });
+            group.on('remove', function() { stop(); control.remove(); });
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, frames, opacity=0.6, bounds=None, interval=FRAME_INTERVAL_MS, loop_pause=LOOP_PAUSE_MS):
+        super().__init__()
+        self._name = "RadarAnimation"
+        self.frames = [list(frame) for frame in frames]  # [(url, nhãn thời gian)] cũ → mới
+        if not self.frames or any(url is None for url, _ in self.frames):
+            raise ValueError("hoạt ảnh radar cần ít nhất 1 khung có URL")
+        self.opacity = float(opacity)
+        self.bounds = bounds or radar_bounds()
+        self.interval = int(interval)
+        self.loop_pause = int(loop_pause)
+
+
+def radar_animation_layer(frames, name, opacity=0.6, bounds=None):
+    """Feature group chứa hoạt ảnh radar (bật/tắt qua LayerControl như lớp thường)"""
+    fg = folium.FeatureGroup(name=name)
+    RadarAnimation(frames, opacity=opacity, bounds=bounds).add_to(fg)
+    return fg
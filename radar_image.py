@@ -0,0 +1,279 @@
+import io
+import threading
+
+import numpy as np
+import shapely
+from PIL import Image, ImageDraw
+
+from radar import radar_bounds
+
+# =====================
+# ⚙️ CẤU HÌNH ẢNH CROP TỪ DỮ LIỆU RADAR
+# =====================
+BASEMAP_BACKGROUND = (245, 245, 240, 255)
+COMMUNE_FILL = (225, 225, 220, 255)
+COMMUNE_OUTLINE = (110, 110, 110, 255)
+OUTLINE_WIDTH = 1
+
+
+# =====================
+# 🧭 GEOREFERENCE ẢNH RADAR
+# =====================
+def _pixel_window(image_size, crop_bounds, source_bounds=None):
+    """Đổi bbox lon/lat (min_lon, min_lat, max_lon, max_lat) → cửa sổ pixel trên ảnh radar"""
+    (lat0, lon0), (lat1, lon1) = source_bounds or radar_bounds()
+    width, height = image_size
+    min_lon, min_lat, max_lon, max_lat = crop_bounds
+    left = (min_lon - lon0) / (lon1 - lon0) * width
+    right = (max_lon - lon0) / (lon1 - lon0) * width
+    top = (lat1 - max_lat) / (lat1 - lat0) * height
+    bottom = (lat1 - min_lat) / (lat1 - lat0) * height
+    return tuple(int(round(v)) for v in (left, top, right, bottom))
+
+
+def crop_radar_png(png_bytes, crop_bounds, source_bounds=None):
+    """Cắt ảnh CMAX gốc theo bbox lon/lat → ảnh RGBA (giữ độ phân giải gốc)"""
+    img = Image.open(io.BytesIO(png_bytes)).convert("RGBA")
+    return img.crop(_pixel_window(img.size, crop_bounds, source_bounds))
+
+
+# =====================
+# 🗺️ BẢN ĐỒ NỀN + RANH GIỚI XÃ (cache theo kích thước ảnh)
+# =====================
+class RadarComposer:
+    """Ghép ảnh radar đã crop lên bản đồ nền lớp xã, không cần trình duyệt"""
+
+    def __init__(self, gdf):
+        self.geoms = np.asarray(gdf.geometry.values, dtype=object)
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def _rings_px(self, crop_bounds, size):
+        min_lon, min_lat, max_lon, max_lat = crop_bounds
+        width, height = size
+        scale = np.array([width / (max_lon - min_lon), -height / (max_lat - min_lat)])
+        offset = np.array([min_lon, max_lat])
+        for geom in self.geoms:
+            polys = geom.geoms if geom.geom_type == "MultiPolygon" else [geom]
+            for poly in polys:
+                for ring in [poly.exterior, *poly.interiors]:
+                    coords = (shapely.get_coordinates(ring) - offset) * scale
+                    yield [tuple(p) for p in coords]
+
+    def _render_layers(self, crop_bounds, size):
+        """Vẽ 1 lần: nền (fill xã) và lớp ranh giới (trong suốt) cho bbox + size"""
+        base = Image.new("RGBA", size, BASEMAP_BACKGROUND)
+        outline = Image.new("RGBA", size, (0, 0, 0, 0))
+        draw_base = ImageDraw.Draw(base)
+        draw_outline = ImageDraw.Draw(outline)
+        for ring in self._rings_px(crop_bounds, size):
+            if len(ring) < 3:
+                continue
+            draw_base.polygon(ring, fill=COMMUNE_FILL)
+            draw_outline.line(ring + [ring[0]], fill=COMMUNE_OUTLINE, width=OUTLINE_WIDTH)
+        return base, outline
+
+    def layers(self, crop_bounds, size):
+        key = (tuple(crop_bounds), tuple(size))
+        with self._lock:
+            if key not in self._layers:
+                self._layers[key] = self._render_layers(crop_bounds, size)
+            return self._layers[key]
+
+    def compose(self, png_bytes, crop_bounds, opacity=1.0):
+        """Crop ảnh radar gốc + ghép lên nền xã → BytesIO PNG sẵn sàng chèn Excel"""
+        radar = crop_radar_png(png_bytes, crop_bounds)
+        if opacity < 1.0:
+            alpha = radar.getchannel("A").point(lambda a: int(a * opacity))
+            radar.putalpha(alpha)
+
+        base, outline = self.layers(crop_bounds, radar.size)
+        out = Image.alpha_composite(base, radar)
+        out = Image.alpha_composite(out, outline)
+
+        buf = io.BytesIO()
+        out.convert("RGB").save(buf, format="PNG")
+        buf.seek(0)
+        return buf
+
+
+# =====================
+# 🎨 GIẢI MÃ BẢNG MÀU CMAX → dBZ (theo legend_radar.jpg)
+# =====================
+# (màu RGB lấy mẫu từ legend, ngưỡng dBZ dưới của khoảng màu)
+RADAR_PALETTE = [
+    ((107, 210, 253), 5),
+    ((2, 109, 249), 10),
+    ((7, 69, 248), 15),
+    ((167, 250, 132), 20),
+    ((87, 250, 35), 25),
+    ((6, 224, 50), 30),
+    ((255, 216, 0), 35),
+    ((255, 166, 0), 40),
+    ((254, 129, 19), 45),
+    ((255, 28, 1), 55),
+    ((204, 0, 113), 60),
+    ((153, 0, 204), 65),
+]
+PALETTE_MAX_DISTANCE = 60   # màu xa hơn mọi màu legend → coi như không có phản hồi
+NO_ECHO = -1
+
+
+def _build_palette_lut():
+    """LUT 32768 ô (RGB 5 bit/kênh) → chỉ số mức dBZ gần nhất (NO_ECHO nếu quá xa)"""
+    levels = np.arange(32, dtype=np.int32) * 8 + 4
+    r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+    rgb = np.stack([r, g, b], axis=-1).reshape(-1, 1, 3)
+    palette = np.array([color for color, _ in RADAR_PALETTE], dtype=np.int32)
+    dist = np.sqrt(((rgb - palette[None, :, :]) ** 2).sum(axis=-1))
+    lut = dist.argmin(axis=1).astype(np.int8)
+    lut[dist.min(axis=1) > PALETTE_MAX_DISTANCE] = NO_ECHO
+    return lut
+
+
+_PALETTE_LUT = _build_palette_lut()
+DBZ_LEVELS = np.array([dbz for _, dbz in RADAR_PALETTE], dtype=np.float32)
+
+
+def _decode_rgba(png_bytes):
+    return np.asarray(Image.open(io.BytesIO(png_bytes)).convert("RGBA"))
+
+
+def _rgba_to_levels(rgba):
+    """Pixel RGBA (mảng [..., 4]) → chỉ số mức dBZ qua LUT (NO_ECHO nếu trong suốt)"""
+    key = (
+        (rgba[..., 0].astype(np.int32) >> 3) << 10
+        | (rgba[..., 1].astype(np.int32) >> 3) << 5
+        | (rgba[..., 2].astype(np.int32) >> 3)
+    )
+    levels = _PALETTE_LUT[key]
+    levels[rgba[..., 3] < 128] = NO_ECHO
+    return levels
+
+
+def decode_dbz_levels(png_bytes):
+    """Ảnh CMAX → mảng chỉ số mức dBZ (int8, NO_ECHO ở nền trong suốt/không có phản hồi)"""
+    return _rgba_to_levels(_decode_rgba(png_bytes))
+
+
+def decode_dbz(png_bytes):
+    """Ảnh CMAX → lưới dBZ float32 (NaN nơi không có phản hồi)"""
+    levels = decode_dbz_levels(png_bytes)
+    return np.where(levels >= 0, DBZ_LEVELS[np.clip(levels, 0, None)], np.nan)
+
+
+# =====================
+# 🗜️ KHUNG RADAR GỌN CHO LỚP PHỦ BẢN ĐỒ
+# =====================
+def transcode_frame(png_bytes, crop_bounds, source_bounds=None):
+    """Khung CMAX gốc → (PNG bảng màu đã crop, bounds [[lat_min, lon_min], [lat_max, lon_max]])
+
+    Chỉ giữ phần ảnh phủ bbox lon/lat (vd. lớp xã), mọi pixel không có phản hồi
+    thành trong suốt hoàn toàn, màu được lượng tử về đúng bảng màu legend → PNG
+    indexed 4 bit nhỏ hơn nhiều lần ảnh gốc. Bounds được tính lại theo đúng cửa sổ
+    pixel đã cắt để lớp phủ khớp vị trí ảnh gốc.
+    """
+    img = Image.open(io.BytesIO(png_bytes))
+    width, height = img.size
+    left, top, right, bottom = _pixel_window(img.size, crop_bounds, source_bounds)
+    left, right = max(left, 0), min(right, width)
+    top, bottom = max(top, 0), min(bottom, height)
+
+    levels = _rgba_to_levels(np.asarray(img.convert("RGBA").crop((left, top, right, bottom))))
+    indexed = Image.fromarray((levels + 1).astype(np.uint8), mode="P")  # 0 = không phản hồi
+    indexed.putpalette([0, 0, 0] + [c for color, _ in RADAR_PALETTE for c in color])
+    buf = io.BytesIO()
+    indexed.save(buf, format="PNG", optimize=True, transparency=0, bits=4)
+
+    (lat0, lon0), (lat1, lon1) = source_bounds or radar_bounds()
+    bounds = [
+        [lat1 - bottom / height * (lat1 - lat0), lon0 + left / width * (lon1 - lon0)],
+        [lat1 - top / height * (lat1 - lat0), lon0 + right / width * (lon1 - lon0)],
+    ]
+    return buf.getvalue(), bounds
+
+
+# =====================
+# 📊 THỐNG KÊ CƯỜNG ĐỘ RADAR THEO XÃ (zonal statistics)
+# =====================
+class CommuneRadarStats:
+    """Raster hóa lớp xã 1 lần lên lưới ảnh radar, tính max/mean dBZ từng xã bằng bincount"""
+
+    def __init__(self, gdf):
+        self.gdf = gdf
+        self.geoms = np.asarray(gdf.geometry.values, dtype=object)
+        self._label_grids = {}
+        self._lock = threading.Lock()
+
+    def _rasterize(self, shape):
+        """Lưới nhãn (0 = ngoài tỉnh, i+1 = xã thứ i) khớp lưới ảnh radar"""
+        height, width = shape
+        (lat0, lon0), (lat1, lon1) = radar_bounds()
+        scale = np.array([width / (lon1 - lon0), -height / (lat1 - lat0)])
+        offset = np.array([lon0, lat1])
+
+        canvas = Image.new("I", (width, height), 0)
+        draw = ImageDraw.Draw(canvas)
+        # Xã lớn vẽ trước → xã nằm lọt trong lỗ của xã khác được vẽ đè đúng nhãn
+        for i in np.argsort(-shapely.area(self.geoms)):
+            geom = self.geoms[i]
+            polys = geom.geoms if geom.geom_type == "MultiPolygon" else [geom]
+            for poly in polys:
+                ext = (shapely.get_coordinates(poly.exterior) - offset) * scale
+                draw.polygon([tuple(p) for p in ext], fill=int(i) + 1)
+                for hole in poly.interiors:
+                    pts = (shapely.get_coordinates(hole) - offset) * scale
+                    draw.polygon([tuple(p) for p in pts], fill=0)
+        return np.asarray(canvas, dtype=np.int32)
+
+    def label_grid(self, shape):
+        """(chỉ số pixel phẳng nằm trong tỉnh, nhãn xã tương ứng, số pixel mỗi xã)"""
+        with self._lock:
+            if shape not in self._label_grids:
+                labels = self._rasterize(shape).ravel()
+                inside = np.flatnonzero(labels)
+                total = np.bincount(labels[inside], minlength=len(self.geoms) + 1)
+                self._label_grids[shape] = (inside, labels[inside], total)
+            return self._label_grids[shape]
+
+    def compute(self, png_bytes, levels=None):
+        """Max/mean dBZ + tỉ lệ diện tích có phản hồi cho từng xã → DataFrame
+
+        `levels`: lưới mức dBZ đã giải mã sẵn (decode_dbz_levels) → bỏ qua bước giải mã ảnh.
+        """
+        if levels is None:
+            rgba = _decode_rgba(png_bytes)
+            inside, labels, total = self.label_grid(rgba.shape[:2])
+            # Chỉ giải mã màu các pixel nằm trong tỉnh
+            levels = _rgba_to_levels(rgba.reshape(-1, 4)[inside])
+        else:
+            inside, labels, total = self.label_grid(levels.shape)
+            levels = levels.ravel()[inside]
+
+        n = len(self.geoms) + 1
+        n_levels = len(DBZ_LEVELS)
+
+        echo = levels >= 0
+        counts = np.bincount(
+            labels[echo] * n_levels + levels[echo], minlength=n * n_levels
+        ).reshape(n, n_levels)
+        echo_pixels = counts.sum(axis=1)
+
+        has_echo = echo_pixels > 0
+        # Mức cao nhất có ít nhất 1 pixel → max dBZ
+        top_level = n_levels - 1 - np.argmax(counts[:, ::-1] > 0, axis=1)
+        max_dbz = np.where(has_echo, DBZ_LEVELS[top_level], np.nan)
+        mean_dbz = np.where(has_echo, counts @ DBZ_LEVELS / np.maximum(echo_pixels, 1), np.nan)
+        echo_fraction = echo_pixels / np.maximum(total, 1)
+
+        result = self.gdf[["Xa", "Diem"]].copy()
+        result["max_dbz"] = max_dbz[1:]
+        result["mean_dbz"] = mean_dbz[1:].round(1)
+        result["echo_fraction"] = echo_fraction[1:].round(3)
+        return result
+
+    def select_over(self, png_bytes, threshold, levels=None):
+        """Các xã có max dBZ ≥ ngưỡng → (GeoDataFrame xã, bảng thống kê tương ứng)"""
+        stats = self.compute(png_bytes, levels)
+        mask = (stats["max_dbz"] >= threshold).to_numpy()
+        return self.gdf[mask], stats[mask]
@@ -0,0 +1,252 @@
+import glob
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from openpyxl import load_workbook
+from openpyxl.drawing.image import Image as XLImage
+from openpyxl.utils import column_index_from_string, get_column_letter
+from PIL import Image
+
+from metrics import timed
+
+# =====================
+# ⚙️ CẤU HÌNH TEMPLATE BÁO CÁO
+# =====================
+TEMPLATE_PATH = "template.xlsx"
+DATA_START_ROW = 46      # dòng đầu tiên của danh sách Điểm dự báo / xã
+HIDE_FROM_ROW = 60       # từ dòng này trở đi: dòng chưa ghi sẽ bị ẩn
+DIEM_COL = 1
+XA_COL = 3
+
+# ⚠️ Vị trí chèn ảnh radar — ảnh neo tại B14, kéo giãn tới hết F23
+RADAR_IMG_CELL = "B14"
+RADAR_IMG_END_CELL = ("F", 23)
+RADAR_IMG_SCALE = 2      # ảnh chèn = kích thước vùng B14:F23 × hệ số này (đủ nét khi in)
+RADAR_IMG_CACHE = 8      # số ảnh radar đã thu nhỏ được giữ lại (theo hash nội dung)
+
+REPORT_ARCHIVE_DIR = "reports"     # nơi lưu các bản báo cáo app đã xuất (đã .gitignore)
+REPORT_KEEP_SECONDS = 24 * 3600    # bản xuất cũ hơn sẽ bị xóa
+REPORT_KEEP_FILES = 200            # giữ tối đa số bản xuất mới nhất
+
+
+def report_filename(now=None, suffix=""):
+    """Tên file báo cáo: NGAN_DONG_YYYYmmdd_HHMM[_suffix].xlsx"""
+    filename_base = (now or datetime.now()).strftime("NGAN_DONG_%Y%m%d_%H%M")
+    if suffix:
+        filename_base = f"{filename_base}_{suffix}"
+    return f"{filename_base}.xlsx"
+
+
+def _col_width_px(ws, col_letter):
+    cd = ws.column_dimensions.get(col_letter)
+    w = cd.width if cd and cd.width else 8.43
+    return int(w * 7 + 5)
+
+
+def _row_height_px(ws, row_num):
+    rd = ws.row_dimensions.get(row_num)
+    h = rd.height if rd and rd.height else 15
+    return int(h * 96 / 72)
+
+
+# =====================
+# 📄 TEMPLATE ĐÃ PHÂN TÍCH SẴN (dùng lại cho mọi lần xuất)
+# =====================
+class ReportTemplate:
+    """Đọc template.xlsx 1 lần, dựng sẵn chỉ mục merged cell và vùng cần xóa
+
+    Mỗi lần xuất: ghi dữ liệu lên workbook đã cache → lưu ra file → hoàn tác,
+    nên template trong bộ nhớ luôn giữ nguyên như lúc đọc.
+    (copy.deepcopy workbook openpyxl làm hỏng style/dimension nên không dùng.)
+    """
+
+    def __init__(self, path=TEMPLATE_PATH):
+        self.path = path
+        with timed("excel.load"):
+            self._wb = load_workbook(path)
+        self._lock = threading.Lock()
+        ws = self._wb.active
+
+        # Lưu max_row của template trước khi ghi dữ liệu
+        self.max_row = ws.max_row
+
+        # Ô bất kỳ trong vùng merge → ô góc trên-trái (ô duy nhất ghi được)
+        self.merged_anchor = {}
+        for merged_range in ws.merged_cells.ranges:
+            anchor = (merged_range.min_row, merged_range.min_col)
+            for row in range(merged_range.min_row, merged_range.max_row + 1):
+                for col in range(merged_range.min_col, merged_range.max_col + 1):
+                    self.merged_anchor[(row, col)] = anchor
+
+        # Các ô có dữ liệu từ DATA_START_ROW trở đi (dữ liệu mẫu cần xóa)
+        self.data_cells = [
+            (cell.row, cell.column)
+            for row in ws.iter_rows(min_row=DATA_START_ROW)
+            for cell in row
+            if cell.value is not None
+        ]
+
+        # Ảnh radar đã thu nhỏ theo hash ảnh gốc (xuất nhiều lần cùng 1 ảnh không phải xử lý lại)
+        self._radar_images = OrderedDict()
+
+        # Ảnh có sẵn trong template: openpyxl đóng file ảnh sau mỗi lần lưu → giữ bytes
+        self._template_images = [(img, img._data()) for img in ws._images]
+
+        # Kích thước pixel vùng chèn ảnh radar (B14:F23)
+        start_col = column_index_from_string(RADAR_IMG_CELL[0])
+        start_row = int(RADAR_IMG_CELL[1:])
+        end_col = column_index_from_string(RADAR_IMG_END_CELL[0])
+        end_row = RADAR_IMG_END_CELL[1]
+        self.radar_box_px = (
+            sum(_col_width_px(ws, get_column_letter(c)) for c in range(start_col, end_col + 1)),
+            sum(_row_height_px(ws, r) for r in range(start_row, end_row + 1)),
+        )
+
+    def anchor(self, row, col):
+        """Ô thực sự ghi được cho (row, col) — tra chỉ mục O(1), không unmerge"""
+        return self.merged_anchor.get((row, col), (row, col))
+
+    def _fit_radar_png(self, data):
+        """Thu nhỏ ảnh radar về vùng B14:F23 × RADAR_IMG_SCALE, bỏ alpha, nén PNG tối ưu"""
+        img = Image.open(io.BytesIO(data))
+        target = tuple(v * RADAR_IMG_SCALE for v in self.radar_box_px)
+        if img.width > target[0] or img.height > target[1]:
+            img = img.resize(target, Image.LANCZOS)  # ảnh được kéo giãn đúng vùng ô như trước
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, format="PNG", optimize=True)
+        return out.getvalue()
+
+    def _radar_image(self, radar_buf):
+        # Dùng buffer gốc không sao chép, ảnh đã thu nhỏ được cache theo hash nội dung
+        data = radar_buf.getbuffer()
+        key = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            png = self._radar_images.get(key)
+        if png is None:
+            png = self._fit_radar_png(data)
+            with self._lock:
+                self._radar_images[key] = png
+                while len(self._radar_images) > RADAR_IMG_CACHE:
+                    self._radar_images.popitem(last=False)
+        del data  # nhả memoryview → buffer gốc vẫn ghi/đọc lại được
+
+        # ✅ Mỗi lần xuất dùng 1 BytesIO riêng → openpyxl đóng file ảnh khi lưu không ảnh hưởng cache
+        xl_img = XLImage(io.BytesIO(png))
+        xl_img.anchor = RADAR_IMG_CELL
+        xl_img.width, xl_img.height = self.radar_box_px  # pixel của vùng Excel
+        return xl_img
+
+    def render(self, grouped_df, out, radar_buf=None):
+        """Ghi danh sách (Diem, Xa) từ dòng 46 + ảnh radar, lưu ra `out`
+
+        `out` là đường dẫn hoặc file-like. Trả về (kích thước ảnh radar hoặc None,
+        lỗi chèn ảnh hoặc None).
+        """
+        values = {}
+        for row, col in self.data_cells:
+            values[(row, col)] = None  # Bước 1: xóa dữ liệu mẫu từ dòng 46
+        for i, row in enumerate(grouped_df.itertuples(index=False), start=DATA_START_ROW):
+            values[self.anchor(i, DIEM_COL)] = row.Diem  # Bước 2: ghi dữ liệu mới
+            values[self.anchor(i, XA_COL)] = row.Xa
+
+        # Bước 3: Ẩn/hiện dòng từ 60 đến max_row của template
+        # Dòng đã ghi (≤ last_written_row): hiện — dòng chưa ghi: ẩn
+        last_written_row = DATA_START_ROW + len(grouped_df) - 1
+        hidden = {
+            row_idx: row_idx > last_written_row
+            for row_idx in range(HIDE_FROM_ROW, self.max_row + 1)
+        }
+
+        # Bước 4: Chuẩn bị ảnh radar (nếu có)
+        xl_img, image_size, image_err = None, None, None
+        if radar_buf:
+            try:
+                xl_img = self._radar_image(radar_buf)
+                image_size = self.radar_box_px
+            except Exception as img_err:
+                image_err = str(img_err)
+
+        with self._lock:
+            ws = self._wb.active
+            cells = ws._cells
+            old_values = {key: cells[key].value for key in values if key in cells}
+            old_hidden = {r: ws.row_dimensions[r].hidden for r in hidden if r in ws.row_dimensions}
+            try:
+                with timed("excel.fill"):
+                    for (row, col), value in values.items():
+                        ws.cell(row=row, column=col).value = value
+                    for row_idx, is_hidden in hidden.items():
+                        ws.row_dimensions[row_idx].hidden = is_hidden
+                    for img, data in self._template_images:
+                        img.ref = io.BytesIO(data)
+                    if xl_img is not None:
+                        ws.add_image(xl_img)
+                with timed("excel.save"):
+                    self._wb.save(out)
+            finally:
+                # Hoàn tác → template trong bộ nhớ trở lại nguyên trạng
+                for key in values:
+                    if key in old_values:
+                        cells[key].value = old_values[key]
+                    else:
+                        cells.pop(key, None)
+                for row_idx in hidden:
+                    if row_idx in old_hidden:
+                        ws.row_dimensions[row_idx].hidden = old_hidden[row_idx]
+                    else:
+                        ws.row_dimensions.pop(row_idx, None)
+                if xl_img is not None:
+                    ws._images.remove(xl_img)
+
+        return image_size, image_err
+
+    def export(self, grouped_df, radar_buf=None, out_dir=REPORT_ARCHIVE_DIR, now=None, suffix=None):
+        """Ghi báo cáo thẳng ra file NGAN_DONG_*_<suffix>.xlsx trong out_dir (1 lần, không giữ bytes)
+
+        suffix (mặc định: uuid ngắn) làm tên file riêng cho mỗi lần xuất → 2 session xuất
+        cùng phút không ghi đè file của nhau. Ghi vào file tạm cùng thư mục rồi đổi tên →
+        file lưu trữ luôn hoàn chỉnh; tải xuống đọc lại từ chính file này.
+        Sau mỗi lần xuất, các bản cũ trong out_dir được dọn theo prune_reports.
+        Trả về (đường dẫn, kích thước ảnh radar, lỗi chèn ảnh).
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        suffix = suffix or uuid.uuid4().hex[:8]
+        path = os.path.join(out_dir, report_filename(now, suffix=suffix))
+        fd, tmp_path = tempfile.mkstemp(suffix=".xlsx.tmp", dir=out_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image_size, image_err = self.render(grouped_df, f, radar_buf)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        prune_reports(out_dir, keep=path)
+        return path, image_size, image_err
+
+
+def prune_reports(out_dir=REPORT_ARCHIVE_DIR, max_age=REPORT_KEEP_SECONDS, max_files=REPORT_KEEP_FILES,
+                  keep=None):
+    """Xóa bản xuất cũ hơn max_age giây và chỉ giữ max_files bản mới nhất (trừ file `keep`)"""
+    files = []
+    for path in glob.glob(os.path.join(out_dir, "NGAN_DONG_*.xlsx")):
+        try:
+            files.append((os.path.getmtime(path), path))
+        except OSError:
+            pass  # session khác vừa xóa
+    files.sort(reverse=True)
+    cutoff = time.time() - max_age
+    for i, (mtime, path) in enumerate(files):
+        if path != keep and (i >= max_files or mtime < cutoff):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
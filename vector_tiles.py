@@ -0,0 +1,190 @@
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+import shapely
+from branca.element import MacroElement
+from jinja2 import Template
+
+from communes import DISPLAY_FIELDS, simplify_display_geometries
+
+# =====================
+# ⚙️ CẤU HÌNH VECTOR TILES
+# =====================
+# Streamlit phục vụ thư mục ./static tại /app/static khi bật enableStaticServing
+TILE_CACHE_DIR = os.path.join("static", "tiles", "xa")
+TILE_URL = "/app/static/tiles/xa/{z}/{x}/{y}.pbf"
+TILE_LAYER_NAME = "xa"
+TILE_MIN_ZOOM = 6
+TILE_MAX_ZOOM = 12
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # đơn vị tile, tránh vết cắt ở mép tile
+
+WEB_MERCATOR_HALF = 20037508.342789244
+
+
+# =====================
+# 🧮 CHUYỂN TỌA ĐỘ / CHỈ SỐ TILE
+# =====================
+def _to_web_mercator(coords):
+    lon = coords[:, 0]
+    lat = np.clip(coords[:, 1], -85.0511, 85.0511)
+    x = lon * WEB_MERCATOR_HALF / 180.0
+    y = np.log(np.tan((90.0 + lat) * np.pi / 360.0)) * WEB_MERCATOR_HALF / np.pi
+    return np.column_stack([x, y])
+
+
+def _tile_range(bounds, zoom):
+    """Các chỉ số tile (x, y) phủ bbox lon/lat ở mức zoom cho trước"""
+    minx, miny, maxx, maxy = bounds
+    n = 2 ** zoom
+
+    def tile_x(lon):
+        return int((lon + 180.0) / 360.0 * n)
+
+    def tile_y(lat):
+        lat_rad = math.radians(lat)
+        return int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+
+    for x in range(tile_x(minx), tile_x(maxx) + 1):
+        for y in range(tile_y(maxy), tile_y(miny) + 1):
+            yield x, y
+
+
+def _tile_bounds(x, y, zoom):
+    """Bbox Web Mercator của tile (x, y, zoom)"""
+    size = 2 * WEB_MERCATOR_HALF / 2 ** zoom
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def _geoms_for_zoom(levels, zoom):
+    for max_zoom, geoms, _digits in levels:
+        if max_zoom is None or zoom <= max_zoom:
+            return geoms
+    return levels[-1][1]
+
+
+# =====================
+# 🧱 TẠO VECTOR TILES (MVT/PBF)
+# =====================
+def _layer_fingerprint(gdf):
+    """Hash hình học + thuộc tính tooltip → biết khi nào cần tạo lại tiles"""
+    h = hashlib.sha1()
+    for wkb in shapely.to_wkb(np.asarray(gdf.geometry.values, dtype=object)):
+        h.update(wkb)
+    h.update(json.dumps(gdf[DISPLAY_FIELDS].to_dict("records"), ensure_ascii=False).encode())
+    h.update(f"{TILE_MIN_ZOOM}-{TILE_MAX_ZOOM}-{TILE_EXTENT}-{TILE_BUFFER}".encode())
+    return h.hexdigest()
+
+
+def generate_vector_tiles(gdf, cache_dir=TILE_CACHE_DIR):
+    """Tạo tiles cho lớp xã vào cache_dir (bỏ qua nếu cache còn khớp dữ liệu)
+
+    Trả về (số tile, thông báo lỗi hoặc None).
+    """
+    try:
+        import mapbox_vector_tile
+    except ImportError:
+        return 0, "❌ Chưa cài mapbox-vector-tile trong requirements.txt"
+
+    fingerprint = _layer_fingerprint(gdf)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint:
+            return meta.get("tile_count", 0), None
+
+    levels = simplify_display_geometries(gdf)
+    props = gdf[DISPLAY_FIELDS].to_dict("records")
+    tile_count = 0
+
+    for zoom in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1):
+        merc = shapely.transform(_geoms_for_zoom(levels, zoom), _to_web_mercator)
+        tree = shapely.STRtree(merc)
+
+        for x, y in _tile_range(gdf.total_bounds, zoom):
+            minx, miny, maxx, maxy = _tile_bounds(x, y, zoom)
+            pad = (maxx - minx) * TILE_BUFFER / TILE_EXTENT
+            idx = tree.query(shapely.box(minx - pad, miny - pad, maxx + pad, maxy + pad))
+            if len(idx) == 0:
+                continue
+
+            clipped = shapely.clip_by_rect(merc[idx], minx - pad, miny - pad, maxx + pad, maxy + pad)
+            # Đổi sang hệ tọa độ tile 0..TILE_EXTENT (trục y hướng lên, encoder tự lật)
+            scale = TILE_EXTENT / (maxx - minx)
+            local = shapely.transform(clipped, lambda c: (c - [minx, miny]) * scale)
+
+            features = [
+                {"geometry": geom.wkt, "properties": props[i]}
+                for i, geom in zip(idx, local) if not geom.is_empty
+            ]
+            if not features:
+                continue
+
+            tile = mapbox_vector_tile.encode([{"name": TILE_LAYER_NAME, "features": features}])
+            tile_dir = os.path.join(cache_dir, str(zoom), str(x))
+            os.makedirs(tile_dir, exist_ok=True)
+            with open(os.path.join(tile_dir, f"{y}.pbf"), "wb") as f:
+                f.write(tile)
+            tile_count += 1
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "tile_count": tile_count}, f)
+    return tile_count, None
+
+
+# =====================
+# 🗺️ LỚP VECTOR TILES + TOOLTIP XÃ/HUYỆN
+# =====================
+class VectorTileTooltip(MacroElement):
+    """Tooltip Xã/Huyện khi rê chuột trên lớp VectorGridProtobuf"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var tip = L.tooltip({sticky: true});
+            {{ this.layer_name }}.on('mouseover mousemove', function(e) {
+                var p = e.layer.properties || {};
+                tip.setLatLng(e.latlng)
+                   .setContent('<b>Xã:</b> ' + p.Xa + '<br><b>Huyện:</b> ' + p.Diem)
+                   .openOn({{ this.map_name }});
+            });
+            {{ this.layer_name }}.on('mouseout', function() {
+                {{ this.map_name }}.closeTooltip(tip);
+            });
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, layer, m):
+        super().__init__()
+        self._name = "VectorTileTooltip"
+        self.layer_name = layer.get_name()
+        self.map_name = m.get_name()
+
+
+def add_vector_tile_layer(m, name, style, tile_url=TILE_URL):
+    """Thêm lớp xã dạng vector tiles (chỉ tải các tile đang hiển thị) vào bản đồ"""
+    from folium.plugins import VectorGridProtobuf
+
+    layer = VectorGridProtobuf(
+        tile_url,
+        name=name,
+        options={
+            "interactive": True,
+            "minNativeZoom": TILE_MIN_ZOOM,
+            "maxNativeZoom": TILE_MAX_ZOOM,
+            "vectorTileLayerStyles": {
+                TILE_LAYER_NAME: dict(style, fill=True),
+            },
+        },
+    )
+    layer.add_to(m)
+    VectorTileTooltip(layer, m).add_to(m)
+    return layer
@@ -0,0 +1,102 @@
+"""Tài nguyên dùng chung của app (lớp xã, chỉ mục, template, legend) + khởi động sẵn server.
+
+Các hàm tải ở đây được cache theo process (không phụ thuộc Streamlit) nên có thể nạp
+trước khi server nhận request:
+    python warmup.py                      # nạp sẵn rồi chạy `streamlit run app.py`
+    python warmup.py --server.port 8080   # tham số sau được chuyển cho streamlit run
+"""
+import base64
+import sys
+import time
+from functools import lru_cache
+
+from communes import CommuneIndex, build_display_layer, display_level_for_zoom, load_communes
+from metrics import timed
+
+LEGEND_PATH = "legend_radar.jpg"
+APP_SCRIPT = "app.py"
+MAP_ZOOM_START = 9      # zoom mở đầu của bản đồ → chỉ nạp sẵn mức rút gọn này
+
+
+# =====================
+# 🗂️ TÀI NGUYÊN DÙNG CHUNG (1 lần / process)
+# =====================
+@lru_cache(maxsize=1)
+def commune_layer():
+    """Lớp xã EPSG:4326 (đọc từ cache GeoParquet)"""
+    with timed("communes.load"):
+        return load_communes()
+
+
+@lru_cache(maxsize=1)
+def commune_index():
+    """Chỉ mục không gian của lớp xã — dựng luôn STRtree thay vì đợi lần query đầu"""
+    index = CommuneIndex(commune_layer())
+    index.query(commune_layer().geometry.values[:1])
+    return index
+
+
+@lru_cache(maxsize=None)
+def _display_level(level):
+    return build_display_layer(commune_layer(), level)
+
+
+def display_layer(zoom=MAP_ZOOM_START):
+    """GeoJSON lớp xã đã rút gọn cho mức zoom (mỗi mức chỉ tính khi cần lần đầu)"""
+    return _display_level(display_level_for_zoom(zoom))
+
+
+@lru_cache(maxsize=1)
+def report_template():
+    """Template Excel đã phân tích (openpyxl + PIL chỉ được import khi cần tới)"""
+    from report import ReportTemplate
+
+    return ReportTemplate()
+
+
+@lru_cache(maxsize=1)
+def legend_data_uri():
+    """Ảnh legend radar dạng data URI (None nếu thiếu file)"""
+    try:
+        with open(LEGEND_PATH, "rb") as f:
+            return f"data:image/jpg;base64,{base64.b64encode(f.read()).decode()}"
+    except FileNotFoundError:
+        return None
+
+
+def warm_up():
+    """Nạp trước mọi tài nguyên dùng chung → {bước: ms}; lỗi ở 1 bước không chặn bước khác"""
+    timings = {}
+    for name, load in [
+        ("commune_layer", commune_layer),
+        ("commune_index", commune_index),
+        ("display_layer", display_layer),
+        ("report_template", report_template),
+        ("legend", legend_data_uri),
+    ]:
+        start = time.perf_counter()
+        try:
+            with timed(f"warmup.{name}"):
+                load()
+        except Exception as e:
+            print(f"⚠️ warm-up {name}: {e}", file=sys.stderr)
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    return timings
+
+
+def main(argv=None):
+    """Nạp sẵn tài nguyên rồi chạy Streamlit trong cùng process (app dùng lại cache)"""
+    for name, ms in warm_up().items():
+        print(f"🔥 {name:<16} {ms:>8.1f} ms")
+
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", APP_SCRIPT, *(sys.argv[1:] if argv is None else argv)]
+    return cli.main()
+
+
+if __name__ == "__main__":
+    # Chạy qua module `warmup` (không phải __main__) → app.py `import warmup` gặp đúng cache đã nạp
+    import warmup
+
+    sys.exit(warmup.main())